@@ -14,11 +14,14 @@ import time
 
 from   itertools    import izip
 
-from   scipy        import c_, ones, dot, stats, diff
-from   scipy.linalg import inv
-from   numpy        import log, pi, sqrt, square, diagonal
+from   scipy        import dot, stats, diff
+from   scipy.linalg import cho_factor, cho_solve, get_blas_funcs
+from   scipy.special import stdtr, chdtrc
+from   numpy        import log, pi, sqrt, square, diagonal, eye, empty, asarray, newaxis
 from   numpy.random import randn, seed
 
+from   glu.lib.utils import lazy_property
+
 class ols(object):
   '''
   Class for multi-variate regression using OLS
@@ -34,6 +37,9 @@ class ols(object):
     y_varnm = string with the variable label for y
     x = independent variables, note that a constant is added by default
     x_varnm = string or list of variable labels for the independent variables
+    dtype = floating point type used to store the model data.  Passing
+            float32 halves the memory bandwidth needed for very large
+            numbers of observations, at the cost of precision.
 
   Output:
     There are no values returned by the class. Summary provides printed output.
@@ -52,12 +58,20 @@ class ols(object):
       > print m.p
   '''
 
-  def __init__(self,y,x,y_varnm = 'y',x_varnm = ''):
+  def __init__(self,y,x,y_varnm = 'y',x_varnm = '',dtype = float):
     '''
     Initializing the ols class.
     '''
-    self.y = y
-    self.x = c_[ones(x.shape[0]),x]
+    x = asarray(x)
+    if x.ndim == 1:
+      x = x[:,newaxis]
+
+    # Store the design column-major, so that each variable is contiguous
+    n,k = x.shape
+    self.y = asarray(y,dtype=dtype)
+    self.x = empty((n,k+1),dtype=dtype,order='F')
+    self.x[:,0]  = 1
+    self.x[:,1:] = x
     self.y_varnm = y_varnm
     self.x_varnm = ['const'] + list(x_varnm)
 
@@ -66,10 +80,15 @@ class ols(object):
 
   def estimate(self):
 
-    # estimating coefficients, and basic stats
-    self.inv_xx = inv(dot(self.x.T,self.x))
-    xy          = dot(self.x.T,self.y)
-    self.b      = dot(self.inv_xx,xy)                        # estimate coefficients
+    # estimating coefficients, and basic stats by solving the normal
+    # equations via a Cholesky factorization rather than an explicit inverse.
+    # X'X is formed with a symmetric rank-k update, which only computes the
+    # lower triangle needed by the factorization.
+    syrk,gemv   = get_blas_funcs(('syrk','gemv'),(self.x,))
+    xx          = syrk(1.0,self.x,trans=1,lower=1)           # lower triangle of X'X
+    xy          = gemv(1.0,self.x,self.y,trans=1)            # X'y
+    self.chol   = cho_factor(xx,lower=True)                  # Cholesky factor of X'X
+    self.b      = cho_solve(self.chol,xy)                    # estimate coefficients
 
     self.nobs   = self.y.shape[0]                            # number of observations
     self.ncoef  = self.x.shape[1]                            # number of coef.
@@ -77,23 +96,76 @@ class ols(object):
     self.df_r   = self.ncoef - 1                             # degrees of freedom, regression
 
     self.e      = self.y - dot(self.x,self.b)                # residuals
-    self.sse    = dot(self.e,self.e)/self.df_e               # SSE
-    self.se     = sqrt(diagonal(self.sse*self.inv_xx))       # coef. standard errors
-    self.t      = self.b / self.se                           # coef. t-statistics
-    self.p      = 2*stats.distributions.t.sf(abs(self.t), self.df_e)       # coef. p-values
+    self.rss    = dot(self.e,self.e)                         # residual sum of squares
+    self.sse    = self.rss/self.df_e                         # SSE
 
-    self.R2     = 1 - self.e.var()/self.y.var()                        # model R-squared
-    self.R2adj  = 1-(1-self.R2)*((self.nobs-1)/(self.nobs-self.ncoef)) # adjusted R-square
+  # The remaining statistics are computed on first use, so that callers that
+  # only need the coefficients do not pay for them
 
-    self.F      = self.R2/(1-self.R2)*self.df_e/self.df_r       # model F-statistic
-    self.Fpv    = stats.distributions.f.sf(self.F, self.df_r, self.df_e)      # F-statistic p-value
+  @lazy_property
+  def inv_xx(self):
+    '''
+    Inverse of X'X, computed from the Cholesky factorization
+    '''
+    return cho_solve(self.chol,eye(self.ncoef))
+
+  @lazy_property
+  def se(self):
+    '''
+    Coefficient standard errors
+    '''
+    return sqrt(diagonal(self.sse*self.inv_xx))
+
+  @lazy_property
+  def t(self):
+    '''
+    Coefficient t-statistics
+    '''
+    return self.b / self.se
+
+  @lazy_property
+  def p(self):
+    '''
+    Coefficient p-values
+    '''
+    return 2*stdtr(self.df_e, -abs(self.t))
+
+  @lazy_property
+  def R2(self):
+    '''
+    Model R-squared
+    '''
+    y_mean = self.y.mean()
+    tss    = dot(self.y,self.y) - self.nobs*y_mean*y_mean   # total sum of squares
+    return 1 - self.rss/tss
+
+  @lazy_property
+  def R2adj(self):
+    '''
+    Adjusted R-squared
+    '''
+    return 1-(1-self.R2)*((self.nobs-1)/(self.nobs-self.ncoef))
+
+  @lazy_property
+  def F(self):
+    '''
+    Model F-statistic
+    '''
+    return self.R2/(1-self.R2)*self.df_e/self.df_r
+
+  @lazy_property
+  def Fpv(self):
+    '''
+    F-statistic p-value
+    '''
+    return stats.distributions.f.sf(self.F, self.df_r, self.df_e)
 
   def dw(self):
     '''
     Calculates the Durbin-Waston statistic
     '''
     de = diff(self.e,1)
-    dw = dot(de,de) / dot(self.e,self.e)
+    dw = dot(de,de) / self.rss
 
     return dw
 
@@ -108,13 +180,20 @@ class ols(object):
     Calculate residual skewness, kurtosis, and do the Jarque-Bera test for normality
     '''
 
-    # Calculate residual skewness and kurtosis
-    skew = stats.skew(self.e)
-    kurtosis = 3 + stats.kurtosis(self.e)
+    # Calculate residual skewness and kurtosis from the central moments,
+    # sharing the squared deviations between them
+    d  = self.e - self.e.mean()
+    d2 = d*d
+    m2 = d2.mean()
+    m3 = (d2*d).mean()
+    m4 = (d2*d2).mean()
+
+    skew = m3/m2**1.5
+    kurtosis = m4/(m2*m2)
 
     # Calculate the Jarque-Bera test for normality
     JB = (self.nobs/6) * (square(skew) + (1/4)*square(kurtosis-3))
-    JBpv = stats.distributions.chi2.sf(JB,2)
+    JBpv = chdtrc(2,JB)
 
     return JB, JBpv, kurtosis, skew
 
@@ -124,7 +203,7 @@ class ols(object):
     '''
 
     # Model log-likelihood, AIC, and BIC criterion values
-    ll = -(self.nobs*1/2)*(1+log(2*pi)) - (self.nobs/2)*log(dot(self.e,self.e)/self.nobs)
+    ll = -(self.nobs*1/2)*(1+log(2*pi)) - (self.nobs/2)*log(self.rss/self.nobs)
     aic = -2*ll/self.nobs + (2*self.ncoef/self.nobs)
     bic = -2*ll/self.nobs + (self.ncoef*log(self.nobs))/self.nobs
 
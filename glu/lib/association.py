@@ -622,7 +622,7 @@ class BiallelicLocusModel(object):
 
 
 class LocusModel(object):
-  def __init__(self, formula, y, X, pheno, vars, loci, model_loci, pids, geno_columns):
+  def __init__(self, formula, y, X, pheno, vars, loci, model_loci, pids, geno_columns, mask=None):
     self.formula      = formula
     self.y            = y
     self.X            = X
@@ -632,6 +632,7 @@ class LocusModel(object):
     self.model_loci   = model_loci
     self.pids         = pids
     self.geno_columns = geno_columns
+    self.mask         = mask
 
   def valid(self, minmaf=0.01, mingenos=10):
     for lmodel in self.model_loci.itervalues():
@@ -678,6 +679,13 @@ class LocusModelBuilder(object):
 
     self.phenos         = np.array([ p for p in phenos if p[0] in pidset], dtype=object)
 
+    # Phenotypes and covariates are converted to floating point once, rather
+    # than each time a model is built.  Subject identifiers are left as NaN.
+    self.values         = np.empty(self.phenos.shape, dtype=float)
+    if len(self.phenos):
+      self.values[:,0]  = np.nan
+      self.values[:,1:] = self.phenos[:,1:]
+
   def build_model(self,term,loci):
     if not len(self.phenos):
       return None
@@ -745,20 +753,23 @@ class LocusModelBuilder(object):
 
     m    = self.phenos.shape[0]
     pids = self.phenos[:,0]
-    y    = np.array(self.phenos[:,1], dtype=float).reshape( (-1,1) )
+    y    = self.values[:,1].reshape( (-1,1) )
     X    = np.zeros( (m,k), dtype=float )
 
     i = 0
-    for effect in term.effects(model_loci, self.phenos):
+    for effect in term.effects(model_loci, self.values):
       n = effect.shape[1]
       X[:,i:i+n] = effect
       i += n
 
     mask = np.isfinite(X.sum(axis=1)) & np.isfinite(y.reshape(-1))
     y = y[mask,:]
-    X = X[mask,:]
 
-    return LocusModel(term,y,X,self.pheno_header[1],model_names,loci,model_loci,pids,geno_columns)
+    # Avoid copying the design matrix when no subjects are excluded
+    if not mask.all():
+      X = X[mask,:]
+
+    return LocusModel(term,y,X,self.pheno_header[1],model_names,loci,model_loci,pids,geno_columns,mask)
 
 
 def variable_summary(out, x, categorical_limit=5, verbose=1):
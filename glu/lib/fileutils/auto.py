@@ -147,6 +147,8 @@ def autofile(filename, mode='r', bufsize=-1):
   @param      mode: determine whether the file objects should be opened for input or output,
                     either 'w' or 'r'
   @type       mode: str
+  @param   bufsize: buffer size in bytes, or -1 for the system default
+  @type    bufsize: int
   @return         : file object to read from or write to
   @rtype          : file object
   '''
@@ -158,7 +160,7 @@ def autofile(filename, mode='r', bufsize=-1):
   comp     = compressed_filename(filename)
 
   if not comp:
-    f = file(filename, mode)
+    f = file(filename, mode, bufsize)
   elif comp == 'gzip':
     try:
       f = spawn_compressor(os.environ.get('GLU_GZIP','gzip'), filename, mode, bufsize=bufsize)
@@ -23,6 +23,10 @@ csv.register_dialect('tsv', csv.get_dialect('excel-tab'))
 DIALECT_KWARGS = ['dialect','delimiter','doublequote','escapechar','lineterminator',
                   'quotechar','quoting','skipinitialspace','strict']
 
+# Output buffer size for delimited files, so that rows written one at a
+# time are flushed to the operating system in large blocks
+WRITE_BUFFER_SIZE = 1<<20
+
 _unescape_literal_chars = [('\\r','\r'),('\\t','\t'),('\\n','\n'),('\\\\','\\')]
 
 
@@ -110,7 +114,7 @@ def delimited_table_writer(filename, extra_args=None, **kwargs):
   if extra_args is None and args:
     raise ValueError('Unexpected filename arguments: %s' % ','.join(sorted(args)))
 
-  lfile = autofile(name,'wb') if name!='-' or hyout is None else hyout
+  lfile = autofile(name,'wb',WRITE_BUFFER_SIZE) if name!='-' or hyout is None else hyout
 
   return csv.writer(lfile,**dialect)
 
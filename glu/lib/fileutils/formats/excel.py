@@ -196,7 +196,7 @@ class ExcelWriter(object):
         write(rownum, i, value)
       rownum += 1
 
-    self.row = rownum
+    self.rownum = rownum
 
   def writerow(self, row):
     '''
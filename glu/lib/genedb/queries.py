@@ -8,6 +8,7 @@ __revision__  = '$Id$'
 
 import re
 
+from   glu.lib.utils      import chunk
 from   glu.lib.recordtype import recordtype
 
 CANONICAL_TRANSCRIPT = 1
@@ -18,6 +19,9 @@ CANONICAL_ALL        = CANONICAL_TRANSCRIPT|CANONICAL_CHROMOSOME|CANONICAL_ASSEM
 KGENOME_CHRMAP       = dict( (i,i) for i in range(1,23) )
 KGENOME_CHRMAP.update({23:'X',24:'Y',25:'M'})
 
+# Maximum number of names bound to a single query (SQLITE_MAX_VARIABLE_NUMBER)
+MAX_QUERY_NAMES      = 999
+
 cyto_re = re.compile('(\d+|X|Y)(?:([p|q])(?:(\d+)(.\d+)?)?)?$')
 
 
@@ -26,6 +30,24 @@ SegDupRecord = recordtype('SegDupRecord', 'chrom start stop strand other_chrom o
 RepeatRecord = recordtype('RepeatRecord', 'chrom start stop strand repeatName repeatClass repeatFamily')
 
 
+def query_by_names(con, sql, names):
+  '''
+  Execute a query for a sequence of names, binding at most MAX_QUERY_NAMES
+  names to each execution via an IN clause substituted for %s in sql.  The
+  first column of each result row must be the matching name.  Returns a
+  dictionary that maps every name to a list of matching rows.
+  '''
+  results = dict( (name,[]) for name in names )
+
+  cur = con.cursor()
+  for batch in chunk(results,MAX_QUERY_NAMES):
+    cur.execute(sql % ','.join('?'*len(batch)), batch)
+    for row in cur:
+      results[row[0]].append(row)
+
+  return results
+
+
 def query_genes_by_name(con, gene, canonical_contig=True, canonical_transcript=None, mapped=None):
   sql = '''
   SELECT   a.Alias,g.symbol,g.chrom,MIN(g.txStart) as start,MAX(g.txEnd) as end,g.strand,"GENE"
@@ -57,8 +79,15 @@ def query_genes_by_name(con, gene, canonical_contig=True, canonical_transcript=N
 
   cur = con.cursor()
   cur.execute(sql, (gene,))
-  genes = cur.fetchall()
 
+  return filter_genes(gene,cur.fetchall())
+
+
+def filter_genes(gene, genes):
+  '''
+  Prefer genes with symbols that exactly match the query, followed by those
+  that match ignoring case
+  '''
   if len(genes)>1:
     new_genes = [ g for g in genes if g[1]==gene ]
     if new_genes:
@@ -74,6 +103,32 @@ def query_genes_by_name(con, gene, canonical_contig=True, canonical_transcript=N
   return genes
 
 
+def query_genes_by_names(con, genes, canonical_contig=True):
+  '''
+  Return a dictionary mapping each gene name or alias to the list of
+  matching genes, as would be returned by query_genes_by_name.  Names are
+  matched exactly and not as LIKE patterns.
+  '''
+  sql = '''
+  SELECT   a.Alias,g.symbol,g.chrom,MIN(g.txStart) as start,MAX(g.txEnd) as end,g.strand,"GENE"
+  FROM     alias a, gene g
+  WHERE    %s
+  GROUP BY a.alias,g.symbol
+  ORDER BY g.chrom,start,end,g.symbol,g.canonical DESC
+  '''
+
+  # Conditions are escaped for the final substitution of the IN clause
+  conditions = ['g.name = a.name', 'a.alias IN (%s)']
+
+  if canonical_contig:
+    conditions.append("g.chrom NOT LIKE '%%!_%%' ESCAPE '!'")
+
+  sql     = sql % '\n       AND '.join(conditions)
+  results = query_by_names(con, sql, genes)
+
+  return dict( (gene,filter_genes(gene,rows)) for gene,rows in results.iteritems() )
+
+
 def query_gene_by_name(con,gene,canonical_contig=True,canonical_transcript=None,mapped=None):
   genes = query_genes_by_name(con,gene,canonical_contig=canonical_contig,
                                        canonical_transcript=canonical_transcript,
@@ -197,16 +252,39 @@ def query_cytobands_by_location(con,chrom,start,end):
   return cytoband_name(bands),bands
 
 
-def query_cytoband_by_name(con,name):
+def query_cytobands_by_names(con,names):
+  '''
+  Return a dictionary mapping each name to the list of cytobands with
+  exactly that name
+  '''
+  sql = '''
+  SELECT   band,chrom,start,stop,color
+  FROM     cytoband
+  WHERE    band IN (%s);
+  '''
+
+  results = query_by_names(con, sql, names)
+
+  return dict( (name,[ r[1:] for r in rows ]) for name,rows in results.iteritems() )
+
+
+def query_cytoband_by_name(con,name,exact=None):
+  '''
+  Find a cytoband by exact name or else by prefix.  Exact matches may be
+  supplied when already known, e.g. from query_cytobands_by_names.
+  '''
   sql1 = '''
   SELECT   chrom,start,stop,color
   FROM     cytoband
   WHERE    band = ?;
   '''
 
-  cur = con.cursor()
-  cur.execute(sql1, (name,))
-  results = cur.fetchall()
+  if exact is None:
+    cur = con.cursor()
+    cur.execute(sql1, (name,))
+    exact = cur.fetchall()
+
+  results = exact
 
   if len(results) == 1:
     return results[0]
@@ -254,16 +332,37 @@ def query_contig_by_location(con,chrom,loc):
   return cur.fetchall()
 
 
-def query_contig_by_name(con,name):
+def query_contigs_by_names(con,names):
+  '''
+  Return a dictionary mapping each name to the list of contigs with exactly
+  that name
+  '''
+  sql = '''
+  SELECT   name,chrom,start,stop
+  FROM     contig
+  WHERE    name IN (%s);
+  '''
+
+  results = query_by_names(con, sql, names)
+
+  return dict( (name,[ r[1:] for r in rows ]) for name,rows in results.iteritems() )
+
+
+def query_contig_by_name(con,name,results=None):
+  '''
+  Find a contig by exact name.  Matches may be supplied when already known,
+  e.g. from query_contigs_by_names.
+  '''
   sql1 = '''
   SELECT   chrom,start,stop
   FROM     contig
   WHERE    name = ?;
   '''
 
-  cur = con.cursor()
-  cur.execute(sql1, (name,))
-  results = cur.fetchall()
+  if results is None:
+    cur = con.cursor()
+    cur.execute(sql1, (name,))
+    results = cur.fetchall()
 
   if not results:
     return None
@@ -273,9 +372,12 @@ def query_contig_by_name(con,name):
     raise KeyError('Ambiguous contig "%s"' % name)
 
 
-def query_snps_by_name(con,name,canonical=True,resolve_1kgenome=True):
-
-  if resolve_1kgenome and name.startswith('SNP') and '-' in name:
+def kgenome_snp(name):
+  '''
+  Return the location of a 1000 Genomes SNP named SNP<chrom>-<position>, or
+  None if name is not of that form
+  '''
+  if name.startswith('SNP') and '-' in name:
     try:
       chrom,end = name[3:].split('-')
       chrom = 'chr%s' % KGENOME_CHRMAP[int(chrom)]
@@ -284,6 +386,16 @@ def query_snps_by_name(con,name,canonical=True,resolve_1kgenome=True):
     except (ValueError,IndexError):
       pass
 
+  return None
+
+
+def query_snps_by_name(con,name,canonical=True,resolve_1kgenome=True):
+
+  if resolve_1kgenome:
+    snps = kgenome_snp(name)
+    if snps is not None:
+      return snps
+
   sql = '''
   SELECT   name,chrom,start,end,strand,refAllele,alleles,vclass,func,weight
   FROM     snp
@@ -302,6 +414,32 @@ def query_snps_by_name(con,name,canonical=True,resolve_1kgenome=True):
   return cur.fetchall()
 
 
+def query_snps_by_names(con,names,canonical=True,resolve_1kgenome=True):
+  '''
+  Return a dictionary mapping each name to the list of SNPs with exactly
+  that name, as would be returned by query_snps_by_name
+  '''
+  sql = '''
+  SELECT   name,chrom,start,end,strand,refAllele,alleles,vclass,func,weight
+  FROM     snp
+  WHERE    name IN (%s)'''
+
+  if canonical:
+    sql += "\n    AND    chrom NOT LIKE '%%!_%%' ESCAPE '!'"
+
+  results = {}
+
+  if resolve_1kgenome:
+    for name in names:
+      snps = kgenome_snp(name)
+      if snps is not None:
+        results[name] = snps
+
+  results.update(query_by_names(con, sql, [ name for name in names if name not in results ]))
+
+  return results
+
+
 def query_snp_by_name(con,name,canonical=True):
   snps = query_snps_by_name(con,name,canonical)
   if not snps:
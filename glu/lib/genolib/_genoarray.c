@@ -3840,6 +3840,7 @@ init_genoarray(void)
 		{"count_haplotypes",	count_haplotypes,	METH_VARARGS, "Count haplotypes at two loci"},
 		{"count_diplotypes",	count_diplotypes,	METH_VARARGS, "Count diplotypes at two loci"},
 		{"estimate_ld",	estimate_ld,	METH_VARARGS, "Compute LD statistics from haplotype counts"},
+		{"estimate_ld_batch",	estimate_ld_batch,	METH_VARARGS, "Compute LD statistics between one locus and each of a sequence of loci"},
 		{NULL}  /* Sentinel */
 	};
 
@@ -106,6 +106,7 @@ PyObject *genoarray_ibs(PyObject *self, PyObject *args);
 PyObject *count_haplotypes(PyObject *self, PyObject *args);
 PyObject *count_diplotypes(PyObject *self, PyObject *args);
 PyObject *estimate_ld(PyObject *self, PyObject *args);
+PyObject *estimate_ld_batch(PyObject *self, PyObject *args);
 
 /* Exceptions */
 PyObject *GenotypeLookupError;
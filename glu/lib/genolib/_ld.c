@@ -17,6 +17,7 @@ See GLU license for terms by running: glu license
 
 #include <Python.h>
 #include <math.h>
+#include <string.h>
 #include "_genoarray.h"
 
 
@@ -211,14 +212,163 @@ count_2bit(Py_ssize_t *diplos, int cat1, int cat2)
 }
 
 
+/* Mask of the low bit of every 2-bit genotype field in a 64 bit word */
+#define LOW_BITS_2BIT 0x5555555555555555ULL
+
+/* Sum the 2-bit fields of a word into its bytes.  Each field may hold a
+   value of up to 3, so that each byte receives at most 12. */
+static inline npy_uint64
+sum_2bit_to_bytes(npy_uint64 x)
+{
+	x = (x & 0x3333333333333333ULL) + ((x >> 2) & 0x3333333333333333ULL);
+	return (x + (x >> 4)) & 0x0F0F0F0F0F0F0F0FULL;
+}
+
+/* Sum the bytes of a word, each of which may hold a value of up to 255 */
+static inline Py_ssize_t
+sum_bytes(npy_uint64 x)
+{
+	x = (x & 0x00FF00FF00FF00FFULL) + ((x >> 8) & 0x00FF00FF00FF00FFULL);
+	return (Py_ssize_t)((x * 0x0001000100010001ULL) >> 48);
+}
+
+/* Count the set bits of a word in which only the low bit of each 2-bit
+   field may be set.  The hardware instruction is used when the compiler
+   targets it (e.g. -mpopcnt or -march=native).  Otherwise each field
+   already holds its own count, so the first step of the usual SWAR
+   population count is not needed. */
+static inline Py_ssize_t
+popcount_2bit(npy_uint64 x)
+{
+#if defined(__GNUC__) && defined(__POPCNT__)
+	return __builtin_popcountll(x);
+#else
+	x = sum_2bit_to_bytes(x);
+	return (Py_ssize_t)((x * 0x0101010101010101ULL) >> 56);
+#endif
+}
+
+/* Build, for each genotype category, a bit set of the 2-bit genotype
+   codes that belong to it */
+static void
+category_codes(const int *gcat, Py_ssize_t glen, unsigned int *codes)
+{
+	Py_ssize_t i;
+
+	codes[0] = codes[1] = codes[2] = 0;
+
+	for(i=0; i<glen && i<4; ++i)
+		if(gcat[i] >= 0)
+			codes[gcat[i]] |= 1<<i;
+}
+
+/* Select the 2-bit fields of a word that hold any of a set of genotype
+   codes, given the low and high bits of each field.  The result has the
+   low bit of each matching field set. */
+static inline npy_uint64
+select_2bit(npy_uint64 lo, npy_uint64 hi, unsigned int codes)
+{
+	npy_uint64 m = 0;
+
+	if(codes&1) m |= ~hi & ~lo;
+	if(codes&2) m |= ~hi &  lo;
+	if(codes&4) m |=  hi & ~lo;
+	if(codes&8) m |=  hi &  lo;
+
+	return m & LOW_BITS_2BIT;
+}
+
+/* Select the fields of each genotype category in a word of 2-bit genotypes */
+static inline void
+category_masks(npy_uint64 w, const unsigned int *codes, npy_uint64 *m)
+{
+	npy_uint64 lo = w & LOW_BITS_2BIT;
+	npy_uint64 hi = (w>>1) & LOW_BITS_2BIT;
+
+	m[0] = select_2bit(lo, hi, codes[0]);
+	m[1] = select_2bit(lo, hi, codes[1]);
+	m[2] = select_2bit(lo, hi, codes[2]);
+}
+
+/* Number of words whose selected fields can be added before a 2-bit field
+   may overflow, and number of such sums whose byte totals can be added
+   before a byte may overflow (21*12 = 252) */
+#define WORDS_PER_FIELD_SUM 3
+#define FIELD_SUMS_PER_BYTE_SUM 21
+
+/* Count diplotypes over whole 64 bit words of 2-bit genotypes (32 per
+   word) by selecting the fields of each genotype category in both words
+   and counting the set bits of their intersections.  Rather than counting
+   the bits of every intersection, the intersections of several words are
+   first added field by field and then byte by byte, so that the total for
+   each diplotype is only reduced once per block of words. */
+static void
+count_diplos_2bit_words(const unsigned char *g1, const unsigned char *g2, Py_ssize_t nwords,
+                        const unsigned int *codes1, const unsigned int *codes2, Py_ssize_t *diplos)
+{
+	npy_uint64 w1, w2, m1[3], m2[3], fields[9], bytes[9];
+	Py_ssize_t i, j, k, n, blocks;
+
+	while(nwords >= WORDS_PER_FIELD_SUM)
+	{
+		blocks = nwords/WORDS_PER_FIELD_SUM;
+		if(blocks > FIELD_SUMS_PER_BYTE_SUM)
+			blocks = FIELD_SUMS_PER_BYTE_SUM;
+
+		memset(bytes, 0, sizeof(bytes));
+
+		for(n=0; n<blocks; ++n)
+		{
+			memset(fields, 0, sizeof(fields));
+
+			for(i=0; i<WORDS_PER_FIELD_SUM; ++i, g1+=8, g2+=8)
+			{
+				memcpy(&w1, g1, 8);
+				memcpy(&w2, g2, 8);
+
+				category_masks(w1, codes1, m1);
+				category_masks(w2, codes2, m2);
+
+				for(j=0; j<3; ++j)
+					for(k=0; k<3; ++k)
+						fields[3*j+k] += m1[j] & m2[k];
+			}
+
+			for(j=0; j<9; ++j)
+				bytes[j] += sum_2bit_to_bytes(fields[j]);
+		}
+
+		for(j=0; j<9; ++j)
+			diplos[j] += sum_bytes(bytes[j]);
+
+		nwords -= blocks*WORDS_PER_FIELD_SUM;
+	}
+
+	/* Count the bits of any remaining words directly */
+	for(i=0; i<nwords; ++i, g1+=8, g2+=8)
+	{
+		memcpy(&w1, g1, 8);
+		memcpy(&w2, g2, 8);
+
+		category_masks(w1, codes1, m1);
+		category_masks(w2, codes2, m2);
+
+		for(j=0; j<3; ++j)
+			for(k=0; k<3; ++k)
+				diplos[3*j+k] += popcount_2bit(m1[j] & m2[k]);
+	}
+}
+
+
 static int
 count_diplos_2bit_c(GenotypeArrayObject *genos1, GenotypeArrayObject *genos2, Py_ssize_t *diplos)
 {
 	UnphasedMarkerModelObject *model1=NULL, *model2=NULL;
 	int *gcat1=NULL, *gcat2=NULL;
+	unsigned int codes1[3], codes2[3];
 	const unsigned char *g1, *g2;
 	const unsigned int *offsets;
-	Py_ssize_t len1, len2, i;
+	Py_ssize_t len1, len2, glen1, glen2, i;
 
 	if(!GenotypeArray_CheckExact(genos1))
 	{
@@ -276,7 +426,16 @@ count_diplos_2bit_c(GenotypeArrayObject *genos1, GenotypeArrayObject *genos2, Py
 	gcat2 = genotype_categories(model2);
 	if(!gcat2) goto error;
 
-	for(i=0; i<len1/4; ++i)
+	glen1 = PyList_Size(model1->genotypes);
+	glen2 = PyList_Size(model2->genotypes);
+
+	/* Count whole words of 32 genotypes at a time */
+	category_codes(gcat1, glen1, codes1);
+	category_codes(gcat2, glen2, codes2);
+	count_diplos_2bit_words(g1, g2, len1/32, codes1, codes2, diplos);
+
+	/* Then the remaining whole bytes of 4 genotypes */
+	for(i=(len1/32)*8; i<len1/4; ++i)
 	{
 		unsigned char a = g1[i];
 		unsigned char b = g2[i];
@@ -535,20 +694,14 @@ convert_args(PyObject *args, Py_ssize_t *haplos)
 	}
 }
 
-PyObject *
-estimate_ld(PyObject *self, PyObject *args)
+static void
+estimate_ld_c(const Py_ssize_t *haplos, double *r2_result, double *dprime_result)
 {
 	const double TOLERANCE = 10e-7;
-	Py_ssize_t haplos[5];
 	int    i;
 	long   c11, c12, c21, c22, dh, n;
 	double p, q, old_p11, p11, p12, p21, p22, a, nx1, nx2;
 	double d, d_max, dprime, r2;
-	PyObject *results;
-
-
-	if(convert_args(args,haplos)<0)
-		return NULL;
 
 	c11 = haplos[0];
 	c12 = haplos[1];
@@ -567,33 +720,45 @@ estimate_ld(PyObject *self, PyObject *args)
 	p = ((double)(c11 + c12 + dh))/n;
 	q = ((double)(c11 + c21 + dh))/n;
 
-	p11 = p*q;
-	p12 = p*(1-q);
-	p21 = (1-p)*q;
-	p22 = (1-p)*(1-q);
-
-	for(i = 0; i < 100; ++i)
+	/* Without double heterozygotes all haplotypes are observed directly and
+	   their relative frequencies are the maximum likelihood estimates */
+	if(!dh)
+	{
+		p11 = ((double)c11)/n;
+		p12 = ((double)c12)/n;
+		p21 = ((double)c21)/n;
+		p22 = ((double)c22)/n;
+	}
+	else
 	{
-		old_p11 = p11;
+		p11 = p*q;
+		p12 = p*(1-q);
+		p21 = (1-p)*q;
+		p22 = (1-p)*(1-q);
 
-		/* Force estimates away from boundaries */
-		p11=dmax(10e-10, p11);
-		p12=dmax(10e-10, p12);
-		p21=dmax(10e-10, p21);
-		p22=dmax(10e-10, p22);
+		for(i = 0; i < 100; ++i)
+		{
+			old_p11 = p11;
+
+			/* Force estimates away from boundaries */
+			p11=dmax(10e-10, p11);
+			p12=dmax(10e-10, p12);
+			p21=dmax(10e-10, p21);
+			p22=dmax(10e-10, p22);
 
-		a = p11*p22 + p12*p21;
+			a = p11*p22 + p12*p21;
 
-		nx1 = dh*p11*p22/a;
-		nx2 = dh*p12*p21/a;
+			nx1 = dh*p11*p22/a;
+			nx2 = dh*p12*p21/a;
 
-		p11 = (c11+nx1)/n;
-		p12 = (c12+nx2)/n;
-		p21 = (c21+nx2)/n;
-		p22 = (c22+nx1)/n;
+			p11 = (c11+nx1)/n;
+			p12 = (c12+nx2)/n;
+			p21 = (c21+nx2)/n;
+			p22 = (c22+nx1)/n;
 
-		if(fabs(old_p11-p11) < TOLERANCE)
-			break;
+			if(fabs(old_p11-p11) < TOLERANCE)
+				break;
+		}
 	}
 
 	d = p11*p22 - p12*p21;
@@ -607,7 +772,14 @@ estimate_ld(PyObject *self, PyObject *args)
 	r2 = d*d/(p*(1-p)*q*(1-q));
 
 bail:
-	results = PyTuple_New(2);
+	*r2_result     = r2;
+	*dprime_result = dprime;
+}
+
+static PyObject *
+ld_results(double r2, double dprime)
+{
+	PyObject *results = PyTuple_New(2);
 
 	if(!results)
 		return NULL;
@@ -617,3 +789,58 @@ bail:
 
 	return results;
 }
+
+PyObject *
+estimate_ld(PyObject *self, PyObject *args)
+{
+	Py_ssize_t haplos[5];
+	double r2, dprime;
+
+	if(convert_args(args,haplos)<0)
+		return NULL;
+
+	estimate_ld_c(haplos, &r2, &dprime);
+
+	return ld_results(r2, dprime);
+}
+
+PyObject *
+estimate_ld_batch(PyObject *self, PyObject *args)
+{
+	PyObject *genos1, *others, *seq=NULL, *results=NULL, *result;
+	Py_ssize_t diplos[9], haplos[5], n, i;
+	double r2, dprime;
+
+	if(!PyArg_ParseTuple(args, "OO", &genos1, &others))
+		return NULL;
+
+	seq = PySequence_Fast(others, "others must be a sequence of genotype arrays");
+	if(!seq) return NULL;
+
+	n = PySequence_Fast_GET_SIZE(seq);
+
+	results = PyList_New(n);
+	if(!results) goto error;
+
+	for(i = 0; i < n; ++i)
+	{
+		if(count_diplos_c(genos1, PySequence_Fast_GET_ITEM(seq, i), diplos) < 0)
+			goto error;
+
+		diplos_to_haplos_c(diplos, haplos);
+		estimate_ld_c(haplos, &r2, &dprime);
+
+		result = ld_results(r2, dprime);
+		if(!result) goto error;
+
+		PyList_SET_ITEM(results, i, result);
+	}
+
+	Py_DECREF(seq);
+	return results;
+
+error:
+	Py_XDECREF(seq);
+	Py_XDECREF(results);
+	return NULL;
+}
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+__abstract__  = 'Helper functions for PrettyBase genotype format parsing'
+__copyright__ = 'Copyright (c) 2010, BioInformed LLC and the U.S. Department of Health & Human Services. Funded by NCI under Contract N01-CO-12400.'
+__license__   = 'See GLU license for terms by running: glu license'
+
+
+cdef inline bint is_sep(char c):
+  return c==' ' or c=='\t' or c==',' or c=='\r' or c=='\v' or c=='\f'
+
+
+def parse_prettybase_block(bytes data, Py_ssize_t end, Py_ssize_t line_num, filename, dict amap,
+                           dict lnames, dict snames):
+  '''
+  Parse all complete prettybase rows in data[:end] into genotriples
+
+  Rows are scanned at C speed and split on runs of whitespace or commas.
+  Blank lines are skipped.  The caller is responsible for ensuring that
+  data[:end] ends on a line boundary.
+
+  @param      data: buffer of raw file contents
+  @type       data: str
+  @param       end: offset one past the last byte to parse
+  @type        end: int
+  @param  line_num: number of lines parsed before this buffer
+  @type   line_num: int
+  @param  filename: file name used in error messages
+  @type   filename: str
+  @param      amap: mapping from allele strings to internal alleles
+  @type       amap: dict
+  @param    lnames: cache used to deduplicate locus names
+  @type     lnames: dict
+  @param    snames: cache used to deduplicate sample names
+  @type     snames: dict
+  @return         : list of (sample,locus,geno) triples and updated line number
+  @rtype          : (list,int)
+  '''
+  cdef const char *buf = data
+  cdef Py_ssize_t i = 0, j, k, n
+  cdef Py_ssize_t starts[4]
+  cdef Py_ssize_t stops[4]
+
+  if end > len(data):
+    raise ValueError('Invalid block end')
+
+  rows   = []
+  append = rows.append
+
+  while i < end:
+    j = i
+    while j < end and buf[j] != '\n':
+      j += 1
+
+    line_num += 1
+
+    n = 0
+    k = i
+    while k < j:
+      while k < j and is_sep(buf[k]):
+        k += 1
+      if k >= j:
+        break
+      if n == 4:
+        n += 1
+        break
+      starts[n] = k
+      while k < j and not is_sep(buf[k]):
+        k += 1
+      stops[n] = k
+      n += 1
+
+    if n:
+      if n != 4:
+        raise ValueError('Invalid prettybase row on line %d of %s' % (line_num,filename))
+
+      locus  = buf[starts[0]:stops[0]]
+      locus  = lnames.setdefault(locus,locus)
+      sample = buf[starts[1]:stops[1]]
+      sample = snames.setdefault(sample,sample)
+      a1     = buf[starts[2]:stops[2]]
+      a2     = buf[starts[3]:stops[3]]
+
+      append( (sample,locus,(amap.get(a1,a1),amap.get(a2,a2))) )
+
+    i = j+1
+
+  return rows,line_num
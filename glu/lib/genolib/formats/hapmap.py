@@ -56,8 +56,11 @@ def load_hapmap(filename,format,genome=None,phenome=None,transform=None,extra_ar
   if extra_args is None and args:
     raise ValueError('Unexpected filename arguments: %s' % ','.join(sorted(args)))
 
-  includeloci = transform.loci.include
-  excludeloci = transform.loci.exclude
+  if transform:
+    includeloci = transform.loci.include
+    excludeloci = transform.loci.exclude
+  else:
+    includeloci = excludeloci = None
 
   gfile = autofile(filename)
   gfile = dropwhile(lambda s: s.startswith('#'), gfile)
@@ -78,8 +81,16 @@ def load_hapmap(filename,format,genome=None,phenome=None,transform=None,extra_ar
   def _load_hapmap():
     modelcache = {}
     n = len(columns)
+
+    # Local string caches that deduplicate the few distinct chromosome and
+    # strand values without growing the global intern table
+    chrom_cache  = {}.setdefault
+    strand_cache = {}.setdefault
+
     for i,line in enumerate(gfile):
-      fields = [ f.strip() for f in line.split(' ') ]
+      # Split off the 11 locus fields and then the genotypes, rather than
+      # splitting and stripping every genotype field individually
+      fields = line.rstrip().split(' ',11)
 
       # FIXME: Issue warning or raise error
       if len(fields) < 11:
@@ -98,8 +109,9 @@ def load_hapmap(filename,format,genome=None,phenome=None,transform=None,extra_ar
       alleles    = tuple(sorted(fields[1].split('/')))
       chromosome = fields[2].strip()
       position   = tryint(fields[3].strip())
-      strand     = intern(fields[4].strip())
-      genos      = fields[11:]
+      strand     = fields[4].strip()
+      strand     = strand_cache(strand,strand)
+      genos      = fields[11].split(' ') if len(fields) > 11 else []
 
       if len(genos) != n:
         raise ValueError('Invalid genotype length in %s:%d for locus %s.  Expected %d genotypes, found %d.' \
@@ -109,7 +121,7 @@ def load_hapmap(filename,format,genome=None,phenome=None,transform=None,extra_ar
       if chromosome.startswith('chr'):
         chromosome = chromosome[3:].strip()
 
-      chromosome = intern(chromosome)
+      chromosome = chrom_cache(chromosome,chromosome)
 
       if len(alleles) != 2 or any(a not in 'ACGT' for a in alleles):
         alleles = tuple(set(a for g in genos for a in g if a!='N'))
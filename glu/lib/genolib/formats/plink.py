@@ -23,7 +23,7 @@ __genoformats__ = [
 import string
 
 from   operator                  import getitem
-from   itertools                 import islice,izip
+from   itertools                 import izip
 
 from   glu.lib.utils             import gcdisabled
 from   glu.lib.fileutils         import autofile,namefile,               \
@@ -193,9 +193,9 @@ def load_plink_ped(filename,format,genome=None,phenome=None,extra_args=None,**kw
 
         phenome.merge_phenos(ename, family, name, efather, emother, sex, pheno)
 
-        a1 = [ aget(a,a) for a in islice(fields,6,None,2) ]
-        a2 = [ aget(a,a) for a in islice(fields,7,None,2) ]
-        genos = zip(a1,a2)
+        alleles = fields[6:]
+        alleles = map(aget,alleles,alleles)
+        genos   = zip(alleles[0::2],alleles[1::2])
 
       yield ename,genos
 
@@ -563,9 +563,9 @@ def load_plink_tped(filename,format,genome=None,phenome=None,extra_args=None,**k
 
         genome.merge_locus(lname, chromosome=chr, location=pdist)
 
-        a1 = [ aget(a,a) for a in islice(fields,4,None,2) ]
-        a2 = [ aget(a,a) for a in islice(fields,5,None,2) ]
-        genos = zip(a1,a2)
+        alleles = fields[4:]
+        alleles = map(aget,alleles,alleles)
+        genos   = zip(alleles[0::2],alleles[1::2])
 
       yield lname,genos
 
@@ -14,14 +14,36 @@ __genoformats__ = [
   ('load_prettybase', 'save_prettybase', 'PrettybaseWriter', 'trip', 'prettybase', 'pb') ]
 
 
-import re
-
 from   glu.lib.fileutils                   import autofile,namefile,parse_augmented_filename, \
                                                   get_arg, trybool,list_reader
 from   glu.lib.fileutils.formats.delimited import get_csv_dialect
 from   glu.lib.genolib.streams             import GenotripleStream
 
 
+# Use the optimized Cython block parser, if available
+try:
+  from glu.lib.genolib.formats._prettybase import parse_prettybase_block
+except ImportError:
+  parse_prettybase_block = None
+
+
+# Number of bytes read and parsed per block by the optimized loader
+PARSE_BLOCK_SIZE = 1<<20
+
+# Pre-built mapping from every single character allele to its internal
+# representation, so that the common case is a single dictionary hit
+ALLELE_MAP = dict( (chr(i),intern(chr(i))) for i in xrange(256) )
+ALLELE_MAP['N'] = ALLELE_MAP['n'] = None
+
+# Number of formatted rows buffered per write by PrettybaseWriter.writerows
+WRITE_BATCH_SIZE = 4096
+
+# Pre-formatted allele columns for the common genotypes, keyed by allele
+# pair.  Genotype objects hash and compare equal to their allele tuples.
+GENO_SUFFIX = dict( ((a1,a2),'%s %s\n' % (a1 or 'N',a2 or 'N'))
+                    for a1 in ('A','C','G','T',None)
+                    for a2 in ('A','C','G','T',None) )
+
 def load_prettybase(filename,format,genome=None,phenome=None,extra_args=None,**kwargs):
   '''
   Load genotype triples from file
@@ -43,6 +65,21 @@ def load_prettybase(filename,format,genome=None,phenome=None,extra_args=None,**k
   ('s1', 'l2', ('G', 'G'))
   ('s2', 'l1', (None, None))
   ('s2', 'l2', ('C', 'C'))
+
+  >>> data = StringIO('l1\\ts1\\tA A\\nl2,s1,G,G\\n\\n l1  s2 N N\\n')
+  >>> for triple in load_prettybase(data,'pb'):
+  ...   print triple
+  ('s1', 'l1', ('A', 'A'))
+  ('s1', 'l2', ('G', 'G'))
+  ('s2', 'l1', (None, None))
+
+  >>> data = ['l1 s1 A A\\n','l2 s1 G G\\n','l1 s2 N N\\n','l2 s2 DEL G\\n']
+  >>> for triple in load_prettybase(data,'pb'):
+  ...   print triple
+  ('s1', 'l1', ('A', 'A'))
+  ('s1', 'l2', ('G', 'G'))
+  ('s2', 'l1', (None, None))
+  ('s2', 'l2', ('DEL', 'G'))
   '''
   if extra_args is None:
     args = kwargs
@@ -67,31 +104,75 @@ def load_prettybase(filename,format,genome=None,phenome=None,extra_args=None,**k
   if loci:
     loci = set(list_reader(loci,**dialect))
 
-  re_spaces = re.compile('[\t ,]+')
   gfile = autofile(filename)
 
   def _load():
-    # Micro-optimization
-    split        = re_spaces.split
-    local_intern = intern
-    local_strip  = str.strip
-    amap         = {'N':None,'n':None}
+    amap         = ALLELE_MAP
+
+    # Local string caches that deduplicate names without growing the
+    # global intern table
+    locus_cache  = {}.setdefault
+    sample_cache = {}.setdefault
 
     for line_num,line in enumerate(gfile):
-      row = split(local_strip(line))
+      # Rows are whitespace delimited, but commas are tolerated as separators
+      if ',' in line:
+        line = line.replace(',',' ')
+
+      row = line.split()
       if not row:
         continue
       elif len(row) != 4:
         raise ValueError('Invalid prettybase row on line %d of %s' % (line_num+1,namefile(filename)))
 
-      locus  = local_intern(local_strip(row[0]))
-      sample = local_intern(local_strip(row[1]))
-      a1,a2  = row[2],row[3]
-      geno   = amap.get(a1,a1),amap.get(a2,a2)
+      # Fields produced by split() never contain whitespace
+      locus,sample,a1,a2 = row
+      locus  = locus_cache(locus,locus)
+      sample = sample_cache(sample,sample)
+
+      try:
+        geno = amap[a1],amap[a2]
+      except KeyError:
+        geno = amap.get(a1,a1),amap.get(a2,a2)
 
       yield sample,locus,geno
 
-  return GenotripleStream.from_tuples(_load(),genome=genome,phenome=phenome,
+  def _load_blocks():
+    read     = gfile.read
+    name     = namefile(filename)
+    amap     = ALLELE_MAP
+    lnames   = {}
+    snames   = {}
+    line_num = 0
+    tail     = ''
+
+    while 1:
+      block = read(PARSE_BLOCK_SIZE)
+      if not block:
+        break
+
+      if tail:
+        block = tail+block
+
+      # Parse only complete lines and carry the remainder into the next block
+      end           = block.rfind('\n')+1
+      rows,line_num = parse_prettybase_block(block,end,line_num,name,amap,lnames,snames)
+      tail          = block[end:]
+
+      for row in rows:
+        yield row
+
+    if tail:
+      rows,line_num = parse_prettybase_block(tail,len(tail),line_num,name,amap,lnames,snames)
+      for row in rows:
+        yield row
+
+  if parse_prettybase_block is not None and hasattr(gfile,'read'):
+    triples = _load_blocks()
+  else:
+    triples = _load()
+
+  return GenotripleStream.from_tuples(triples,genome=genome,phenome=phenome,
                                               samples=samples,loci=loci,
                                               unique=unique,order=order)
 
@@ -160,8 +241,11 @@ class PrettybaseWriter(object):
     if out is None:
       raise IOError('Cannot write to closed writer object')
 
-    out.write( ' '.join( [locus,sample,geno[0] or 'N',geno[1] or 'N'] ) )
-    out.write('\n')
+    suffix = GENO_SUFFIX.get(geno)
+    if suffix is None:
+      suffix = '%s %s\n' % (geno[0] or 'N',geno[1] or 'N')
+
+    out.write('%s %s %s' % (locus,sample,suffix))
 
   def writerows(self, triples):
     '''
@@ -174,12 +258,34 @@ class PrettybaseWriter(object):
     if out is None:
       raise IOError('Cannot write to closed writer object')
 
-    write = out.write
-    join  = ' '.join
+    # Format rows into a buffer and write them out in large batches
+    write    = out.write
+    buf      = []
+    append   = buf.append
+    get      = GENO_SUFFIX.get
+
+    # Formatted alleles are cached keyed by the genotype objects actually
+    # written.  Genotypes hash and compare equal to their allele tuples, so
+    # a GENO_SUFFIX lookup must compare each genotype to a tuple key.  The
+    # shared genotype objects are themselves the cache keys, so dict lookups
+    # match them before any comparison is needed.  The cache also avoids
+    # re-formatting alleles that are not in GENO_SUFFIX.
+    suffixes = {}
 
     for sample,locus,geno in triples:
-      write( join( [locus,sample,geno[0] or 'N',geno[1] or 'N'] ) )
-      write('\n')
+      try:
+        suffix = suffixes[geno]
+      except KeyError:
+        suffix = suffixes[geno] = get(geno) or '%s %s\n' % (geno[0] or 'N',geno[1] or 'N')
+
+      append(locus+' '+sample+' '+suffix)
+
+      if len(buf) >= WRITE_BATCH_SIZE:
+        write(''.join(buf))
+        del buf[:]
+
+    if buf:
+      write(''.join(buf))
 
   def close(self):
     '''
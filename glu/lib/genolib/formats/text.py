@@ -430,18 +430,21 @@ def load_genotriples_text(filename,format,genome=None,phenome=None,extra_args=No
       rows.next()
 
   def _load():
-    # Micro-optimization
-    local_intern = intern
     from_string  = genorepr.from_string
 
+    # Local string caches that deduplicate names without growing the
+    # global intern table
+    sample_cache = {}.setdefault
+    locus_cache  = {}.setdefault
+
     for row in rows:
       if not row:
         continue
       elif len(row) != 3:
         raise ValueError('Invalid genotriple on line %d of %s' % (rows.line_num+1,namefile(filename)))
 
-      sample = local_intern(row[0])
-      locus  = local_intern(row[1])
+      sample = sample_cache(row[0],row[0])
+      locus  = locus_cache(row[1],row[1])
       geno   = from_string(row[2])
 
       yield sample,locus,geno
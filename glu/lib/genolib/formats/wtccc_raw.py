@@ -14,6 +14,7 @@ __genoformats__ = [
 
 import csv
 
+from   string                    import maketrans
 from   itertools                 import islice
 
 from   glu.lib.utils             import is_str
@@ -24,6 +25,10 @@ from   glu.lib.genolib.reprs     import get_genorepr
 from   glu.lib.genolib.locus     import Genome
 
 
+# Missing alleles are coded as '-'
+MISSING_ALLELE_TRANS = maketrans('-',' ')
+
+
 def load_wtccc_raw(filename,format,genome=None,phenome=None,extra_args=None,**kwargs):
   '''
   Load a WTCCC Raw genotype data file.
@@ -76,6 +81,7 @@ def load_wtccc_raw(filename,format,genome=None,phenome=None,extra_args=None,**kw
     # Micro-optimization
     local_intern = intern
     local_strip  = str.strip
+    trans        = MISSING_ALLELE_TRANS
 
     for row in rows:
       if len(row) != n:
@@ -85,9 +91,9 @@ def load_wtccc_raw(filename,format,genome=None,phenome=None,extra_args=None,**kw
       data   = [ d.split(';') for d in islice(row,1,None) ]
 
       if gc:
-        genos = [ d[0].replace('-',' ') if float(d[1])>=gc else '  ' for d in data ]
+        genos = [ d[0].translate(trans) if float(d[1])>=gc else '  ' for d in data ]
       else:
-        genos = [ d[0].replace('-',' ') for d in data ]
+        genos = [ d[0].translate(trans) for d in data ]
 
       yield sample,genos
 
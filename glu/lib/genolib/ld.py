@@ -223,36 +223,44 @@ def estimate_ld_native(c11,c12,c21,c22,dh):
   p = float(c11 + c12 + dh)/n
   q = float(c11 + c21 + dh)/n
 
-  p11 = p*q
-  p12 = p*(1-q)
-  p21 = (1-p)*q
-  p22 = (1-p)*(1-q)
+  # Without double heterozygotes all haplotypes are observed directly and
+  # their relative frequencies are the maximum likelihood estimates
+  if not dh:
+    p11 = float(c11)/n
+    p12 = float(c12)/n
+    p21 = float(c21)/n
+    p22 = float(c22)/n
+  else:
+    p11 = p*q
+    p12 = p*(1-q)
+    p21 = (1-p)*q
+    p22 = (1-p)*(1-q)
 
-  loglike = -999999999
+    loglike = -999999999
 
-  for i in xrange(100):
-    oldloglike=loglike
+    for i in xrange(100):
+      oldloglike=loglike
 
-    # Force estimates away from boundaries
-    p11=max(epsilon, p11)
-    p12=max(epsilon, p12)
-    p21=max(epsilon, p21)
-    p22=max(epsilon, p22)
+      # Force estimates away from boundaries
+      p11=max(epsilon, p11)
+      p12=max(epsilon, p12)
+      p21=max(epsilon, p21)
+      p22=max(epsilon, p22)
 
-    a = p11*p22 + p12*p21
+      a = p11*p22 + p12*p21
 
-    loglike = c11*log(p11) + c12*log(p12) + c21*log(p21) + c22*log(p22) + dh*log(a)
+      loglike = c11*log(p11) + c12*log(p12) + c21*log(p21) + c22*log(p22) + dh*log(a)
 
-    if abs(loglike-oldloglike) < TOLERANCE:
-      break
+      if abs(loglike-oldloglike) < TOLERANCE:
+        break
 
-    nx1 = dh*p11*p22/a
-    nx2 = dh*p12*p21/a
+      nx1 = dh*p11*p22/a
+      nx2 = dh*p12*p21/a
 
-    p11 = (c11+nx1)/n
-    p12 = (c12+nx2)/n
-    p21 = (c21+nx2)/n
-    p22 = (c22+nx1)/n
+      p11 = (c11+nx1)/n
+      p12 = (c12+nx2)/n
+      p21 = (c21+nx2)/n
+      p22 = (c22+nx1)/n
 
   d = p11*p22 - p12*p21
 
@@ -267,6 +275,25 @@ def estimate_ld_native(c11,c12,c21,c22,dh):
   return r2,dprime
 
 
+def estimate_ld_batch_native(genos1, others):
+  '''
+  Compute LD statistics between the genotypes at one locus and those at
+  each of a sequence of other loci.  Returns a list of (r2,dprime) tuples.
+
+  >>> from glu.lib.genolib.genoarray import GenotypeArrayDescriptor,GenotypeArray,build_model
+  >>> model = build_model('AB')
+  >>> def encode(genos): return GenotypeArray(GenotypeArrayDescriptor([model]*len(genos)), genos)
+  >>> genos1 = encode([('A','A'),('A','B'),('B','B'),('B','B'),('A','A')])
+  >>> genos2 = encode([('A','A'),('A','B'),('B','B'),('B','B'),('A','A')])
+  >>> genos3 = encode([('A','A'),('A','A'),('A','A'),('A','A'),('A','A')])
+  >>> for r2,dprime in estimate_ld_batch_native(genos1,[genos2,genos3]):
+  ...   print '%.4f %.4f' % (r2,dprime)
+  1.0000 1.0000
+  0.0000 0.0000
+  '''
+  return [ estimate_ld(*count_haplotypes(genos1,genos2)) for genos2 in others ]
+
+
 def bound_ld_native(c11,c12,c21,c22,dh):
   # Hack to estimate maxd and r2max
   n = c11 + c12 + c21 + c22 + 2*dh
@@ -310,12 +337,14 @@ try:
   # Load the optimized C versions, if available
   from glu.lib.genolib._genoarray import count_haplotypes as count_haplotypes_fast, \
                                          count_diplotypes as count_diplotypes_fast, \
-                                         estimate_ld      as estimate_ld_fast
+                                         estimate_ld      as estimate_ld_fast, \
+                                         estimate_ld_batch as estimate_ld_batch_fast
 
 
-  count_haplotypes = count_haplotypes_fast
-  count_diplotypes = count_diplotypes_fast
-  estimate_ld      = estimate_ld_fast
+  count_haplotypes  = count_haplotypes_fast
+  count_diplotypes  = count_diplotypes_fast
+  estimate_ld       = estimate_ld_fast
+  estimate_ld_batch = estimate_ld_batch_fast
 
   def test_count_haplotypes():
     '''
@@ -372,12 +401,26 @@ try:
     >>> ld=estimate_ld_fast(1,1,0,6,1)
     >>> numpy.allclose(ld, (0.58333333, 1))
     True
+
+    >>> from glu.lib.genolib.genoarray import GenotypeArrayDescriptor,GenotypeArray,build_model
+    >>> model = build_model('AB')
+    >>> def encode(genos): return GenotypeArray(GenotypeArrayDescriptor([model]*len(genos)), genos)
+    >>> genos1 = encode([('A','A'),('A','B'),('B','B'),('B','B'),('A','A'),(None,None)])
+    >>> others = [ encode([('A','A'),('A','B'),('B','B'),('B','B'),('A','A'),('A','B')]),
+    ...            encode([('A','B'),('A','B'),('A','A'),('B','B'),('A','A'),('A','A')]),
+    ...            encode([('A','A'),('A','A'),('A','A'),('A','A'),('A','A'),('A','A')]) ]
+    >>> numpy.allclose(estimate_ld_batch_fast(genos1,others),
+    ...                [ estimate_ld_fast(genos1,genos2) for genos2 in others ])
+    True
+    >>> estimate_ld_batch_fast(genos1,[])
+    []
     '''
 
 except ImportError:
   # If not, fall back on the pure-Python version
-  estimate_ld      = estimate_ld_native
-  count_haplotypes = count_haplotypes_native
+  estimate_ld       = estimate_ld_native
+  estimate_ld_batch = estimate_ld_batch_native
+  count_haplotypes  = count_haplotypes_native
 
 bound_ld = bound_ld_native
 
@@ -15,7 +15,7 @@ import numpy as np
 import scipy.stats
 
 from   numpy        import dot
-from   scipy.linalg import svd,cholesky,norm,inv,schur,rsf2csf,LinAlgError
+from   scipy.linalg import svd,cholesky,cho_factor,cho_solve,norm,inv,schur,rsf2csf,LinAlgError
 
 CONV = 1e-8
 COND = 1e-8
@@ -860,7 +860,7 @@ def block_inverse(w):
 
 
 def grand_mean(X):
-  return np.bmat([ np.ones((len(X),1)), X ]).A
+  return np.hstack([ np.ones((len(X),1)), np.asarray(X) ])
 
 
 def linreg(y, X, add_mean=False):
@@ -1147,24 +1147,28 @@ class GLogit(object):
     if add_mean:
       X = grand_mean(X)
 
-    categories = np.unique(y.ravel())
+    categories,y_ord = np.unique(y.ravel(), return_inverse=True)
 
     if ref is None:
       ref = categories[0]
     else:
       if ref not in categories:
         raise ValueError('reference class for dependent variable not observed in data')
+
+      # Move the reference to code 0 and shift the categories that sort
+      # before it up by one
+      i          = categories.tolist().index(ref)
+      recode     = np.arange(len(categories))
+      recode[:i] += 1
+      recode[i]  = 0
+      y_ord      = recode[y_ord]
       categories = [ref] + [ r for r in categories if r!=ref ]
 
     if len(categories) < 2:
       raise ValueError('less than two dependent variable categories observed')
 
     # Recode y with ordinal categories from 0..k-1, where 0 is reference
-    # FIXME: This should be a scalar loop
-    y_ord = np.zeros_like(y)
-
-    for i,v in enumerate(categories):
-      y_ord[y==v] = i
+    y_ord = y_ord.reshape(y.shape).astype(y.dtype)
 
     self.y     = y
     self.y_ord = y_ord
@@ -1176,6 +1180,10 @@ class GLogit(object):
     self.beta = None
     self.W    = None
 
+    # Fitted covariate-only model that may be shared by the score and
+    # likelihood ratio tests, see fit_null_glogit
+    self.null_fit = None
+
 
   def fit(self, initial_beta=None, max_iterations=50):
     y = self.y_ord
@@ -1351,9 +1359,34 @@ class GLogit(object):
     return GLogitLRTest(self,parameters=parameters,indices=indices)
 
 
+def fit_null_glogit(model,null_indices):
+  '''
+  Fit a GLogit model restricted to the null_indices columns of the design
+  of model, reusing the null model fit supplied in model.null_fit when it
+  was obtained from exactly the same data
+  '''
+  y      = model.y
+  X_null = model.X[:,null_indices]
+  prior  = model.null_fit
+
+  if prior is not None and prior.beta is not None and prior.X.shape == X_null.shape \
+     and np.array_equal(prior.y,y) and np.array_equal(prior.X,X_null):
+    return prior
+
+  null = GLogit(y,X_null)
+
+  # Otherwise, start from the estimates of a null fit with the same design
+  initial_beta = None
+  if prior is not None and prior.beta is not None and prior.X.shape[1] == X_null.shape[1] \
+     and list(prior.categories) == list(null.categories):
+    initial_beta = prior.beta
+
+  null.fit(initial_beta=initial_beta)
+  return null
+
+
 class GLogitScoreTest(object):
   def __init__(self,model,parameters=None,indices=None):
-    y = model.y
     X = model.X
     k = len(model.categories)-1
     n = X.shape[1]
@@ -1370,11 +1403,9 @@ class GLogitScoreTest(object):
     # that are to be scored and excluding those from the null model
     design_indices = set(i%n for i in indices)
     null_indices   = [ i for i in xrange(n) if i not in design_indices ]
-    X_null = X[:,null_indices]
 
     # Fit null model
-    self.null = GLogit(y,X_null)
-    self.null.fit()
+    self.null = fit_null_glogit(model,null_indices)
 
     # Augment null beta with zeros for all parameters to be tested
     null_indices = (i for i in xrange(n*k) if i not in indices)
@@ -1494,7 +1525,6 @@ class GLogitLRTest(object):
   with len(indices) degrees of freedom.
   '''
   def __init__(self,model,initial_beta=None,parameters=None,indices=None):
-    y = model.y
     X = model.X
     k = len(model.categories)-1
     m,n = X.shape
@@ -1511,11 +1541,9 @@ class GLogitLRTest(object):
     # that are to be scored and excluding those from the null model
     design_indices = set(i%n for i in indices)
     null_indices   = [ i for i in xrange(n) if i not in design_indices ]
-    X_null = X[:,null_indices]
 
     # Fit null model
-    self.null = GLogit(y,X_null)
-    self.null.fit()
+    self.null = fit_null_glogit(model,null_indices)
 
     self.model   = model
     self.indices = indices
@@ -1524,6 +1552,97 @@ class GLogitLRTest(object):
     return -2*(self.null.L-self.model.L),len(self.indices)
 
 
+class LinearPrefit(object):
+  '''
+  Cached cross-products of a fixed block of covariates and a response
+
+  When scanning many linear models that share the same covariate columns Z
+  and response y, Z'Z and Z'y need only be computed once.  Models fit to
+  a subset of the original observations are supported by subtracting the
+  contribution of the excluded rows.
+
+  >>> Z = np.array([[1., 0.60],
+  ...               [1., 5.00],
+  ...               [1., 1.00],
+  ...               [1.,-1.00],
+  ...               [1.,-4.20]])
+  >>> y = np.array([3, 4, -1, -5, -1])
+  >>> prefit = LinearPrefit(y,Z)
+  >>> ZtZ,Zty = prefit.cross_products()
+  >>> np.allclose(ZtZ, dot(Z.T,Z)) and np.allclose(Zty, dot(Z.T,y[:,np.newaxis]))
+  True
+  >>> drop = np.array([False,True,False,False,True])
+  >>> ZtZ,Zty = prefit.cross_products(drop)
+  >>> np.allclose(ZtZ, dot(Z[~drop].T,Z[~drop])) and np.allclose(Zty, dot(Z[~drop].T,y[~drop,np.newaxis]))
+  True
+  '''
+  def __init__(self, y, Z):
+    y = np.asarray(y,dtype=float)
+    Z = np.asarray(Z,dtype=float)
+
+    if y.ndim == 1:
+      y = y[:,np.newaxis]
+
+    assert y.shape[1] == 1
+    assert y.shape[0] == Z.shape[0]
+
+    self.y   = y
+    self.Z   = Z
+    self.ZtZ = dot(Z.T,Z)
+    self.Zty = dot(Z.T,y)
+
+  def cross_products(self, drop=None):
+    '''
+    Return Z'Z and Z'y, excluding the rows flagged in the boolean array drop
+    '''
+    ZtZ,Zty = self.ZtZ,self.Zty
+
+    if drop is not None and drop.any():
+      Zd  = self.Z[drop]
+      ZtZ = ZtZ - dot(Zd.T,Zd)
+      Zty = Zty - dot(Zd.T,self.y[drop])
+
+    return ZtZ,Zty
+
+  def cross_products_batch(self, blocks):
+    '''
+    Return Z'G and G'y for each of a sequence of blocks G using a single
+    matrix product
+
+    The rows of each block must be aligned with the rows of Z.  Rows not
+    present in a model should be set to zero, so that they do not
+    contribute to the cross-products.
+
+    >>> Z = np.array([[1., 0.60],
+    ...               [1., 5.00],
+    ...               [1., 1.00]])
+    >>> y = np.array([3, 4, -1])
+    >>> G1 = np.array([[1.],[2.],[0.]])
+    >>> G2 = np.array([[1.,0.],[0.,1.],[1.,1.]])
+    >>> prefit = LinearPrefit(y,Z)
+    >>> (ZtG1,G1ty),(ZtG2,G2ty) = prefit.cross_products_batch([G1,G2])
+    >>> np.allclose(ZtG1,dot(Z.T,G1)) and np.allclose(G1ty,dot(G1.T,y[:,np.newaxis]))
+    True
+    >>> np.allclose(ZtG2,dot(Z.T,G2)) and np.allclose(G2ty,dot(G2.T,y[:,np.newaxis]))
+    True
+    '''
+    if not blocks:
+      return []
+
+    G   = np.hstack(blocks)
+    ZtG = dot(self.Z.T,G)
+    Gty = dot(G.T,self.y)
+
+    crosses = []
+    start   = 0
+    for block in blocks:
+      stop  = start+block.shape[1]
+      crosses.append( (ZtG[:,start:stop],Gty[start:stop]) )
+      start = stop
+
+    return crosses
+
+
 class Linear(object):
   '''
   Full-rank Example
@@ -1676,6 +1795,7 @@ class Linear(object):
 
     self.singular_values        = None
     self.right_singlular_matrix = None
+    self.prefit                 = None
 
   def fit(self):
     y = self.y
@@ -1699,6 +1819,93 @@ class Linear(object):
 
     return L,beta,W,ss
 
+  def fit_with_covariate_prefit(self, prefit, indices, drop=None, cross=None):
+    '''
+    Fit the model using cached cross-products for a block of covariates
+
+    The design matrix columns given by indices must be the covariates used
+    to construct prefit, in the same order, and drop flags the rows of the
+    prefit design that are not present in this model.  Only cross-products
+    involving the remaining columns are computed from the data, unless the
+    covariate cross-products are supplied in cross as returned by
+    LinearPrefit.cross_products_batch.
+
+    Unlike fit(), the normal equations are solved directly and a
+    LinAlgError is raised if the design is not of full rank.
+
+    >>> X = np.array([[1., 0.60, 1.20, 3.90],
+    ...               [1., 5.00, 4.00, 2.50],
+    ...               [1., 1.00,-4.00,-5.50],
+    ...               [1.,-1.00,-2.00,-6.50],
+    ...               [1.,-4.20,-8.40,-4.80]])
+    >>> y = np.array([3, 4, -1, -5, -1])
+    >>> l1 = Linear(y,X)
+    >>> x  = l1.fit()
+    >>> l2 = Linear(y,X)
+    >>> x  = l2.fit_with_covariate_prefit(LinearPrefit(y,X[:,[0,2]]),[0,2])
+    >>> np.allclose(l1.beta,l2.beta) and np.allclose(l1.W,l2.W)
+    True
+    >>> np.allclose([l1.ss,l1.resids,l1.L],[l2.ss,l2.resids,l2.L])
+    True
+    >>> np.allclose(l1.score_test(indices=[1,3]).test(),l2.score_test(indices=[1,3]).test())
+    True
+    '''
+    y = self.y
+    X = self.X
+
+    # n=observations and m=covariates
+    n,m = X.shape
+
+    if n <= m:
+      raise LinAlgError('Insufficient observations to fit model')
+
+    indices = np.asarray(indices, dtype=int)
+    other   = np.setdiff1d(np.arange(m), indices)
+    ZtZ,Zty = prefit.cross_products(drop)
+
+    nobs = len(prefit.y) if drop is None else len(drop)-drop.sum()
+    if ZtZ.shape[0] != len(indices) or nobs != n:
+      raise ValueError('Covariate prefit does not match model design')
+
+    G = X[:,other]
+
+    if cross is None:
+      ZtG = dot(X[:,indices].T,G)
+      Gty = dot(G.T,y)
+    else:
+      ZtG,Gty = cross
+
+    # Assemble X'X and X'y from the cached and per-model blocks
+    XtX = np.empty( (m,m), dtype=float )
+    XtX[np.ix_(indices,indices)] = ZtZ
+    XtX[np.ix_(indices,other)]   = ZtG
+    XtX[np.ix_(other,indices)]   = ZtG.T
+    XtX[np.ix_(other,other)]     = dot(G.T,G)
+
+    Xty = np.empty( (m,1), dtype=float )
+    Xty[indices] = Zty
+    Xty[other]   = Gty
+
+    # cho_factor raises a LinAlgError if X'X is not positive definite
+    c      = cho_factor(XtX)
+    beta   = cho_solve(c,Xty)
+    W      = cho_solve(c,np.eye(m))
+    resids = ((y-dot(X,beta))**2).sum()
+    ss     = resids/(n-m)
+    L      = -(n/2.)*(1+np.log(2*pi)-np.log(n)+np.log(resids))
+
+    self.L      = L
+    self.beta   = beta
+    self.W      = W
+    self.ss     = ss
+    self.resids = resids
+    self.rank   = m
+    self.prefit = prefit,indices,drop
+    self.singular_values        = None
+    self.right_singlular_matrix = None
+
+    return L,beta,W,ss
+
   def p_values(self, phred=False):
     y     = self.y
     b     = self.beta.reshape(-1)
@@ -1728,6 +1935,29 @@ class Linear(object):
     return LinearLRTest(self,parameters=parameters,indices=indices)
 
 
+def fit_null_linear(model,null_indices):
+  '''
+  Fit a Linear model restricted to the null_indices columns of the design
+  of model, reusing the covariate cross-products of model when they cover
+  exactly the same columns
+  '''
+  null = Linear(model.y,model.X[:,null_indices])
+
+  if model.prefit is not None:
+    prefit,indices,drop = model.prefit
+
+    if set(indices) == set(null_indices):
+      pos = dict( (j,i) for i,j in enumerate(null_indices) )
+      try:
+        null.fit_with_covariate_prefit(prefit,[ pos[i] for i in indices ],drop)
+        return null
+      except LinAlgError:
+        pass
+
+  null.fit()
+  return null
+
+
 class LinearScoreTest(object):
   def __init__(self,model,parameters=None,indices=None):
     y = model.y
@@ -1741,11 +1971,9 @@ class LinearScoreTest(object):
 
     design_indices = set(indices)
     null_indices = [ i for i in xrange(n) if i not in design_indices ]
-    X_null = X[:,null_indices]
 
     # Fit null model
-    self.null = Linear(y,X_null)
-    self.null.fit()
+    self.null = fit_null_linear(model,null_indices)
 
     # Augment null beta with zeros for all parameters to be tested
     beta = np.zeros((n,1), dtype=float)
@@ -1829,7 +2057,6 @@ class LinearLRTest(object):
   with len(indices) degrees of freedom.
   '''
   def __init__(self,model,parameters=None,indices=None):
-    y = model.y
     X = model.X
     n = X.shape[1]
 
@@ -1840,11 +2067,9 @@ class LinearLRTest(object):
 
     design_indices = set(indices)
     null_indices = [ i for i in xrange(n) if i not in design_indices ]
-    X_null = X[:,null_indices]
 
     # Fit null model
-    self.null = Linear(y,X_null)
-    self.null.fit()
+    self.null = fit_null_linear(model,null_indices)
 
     self.model   = model
     self.indices = indices
@@ -25,3 +25,22 @@ class GLUArgumentParser(argparse.ArgumentParser):
       self.print_usage()
 
     self.exit(2, _('\n%s: command error: %s\n') % (self.prog, message))
+
+
+def process_count(value):
+  '''
+  Argument type for a number of worker processes, which must be at least 1
+
+  >>> process_count('4')
+  4
+  >>> process_count('0')
+  Traceback (most recent call last):
+     ...
+  ArgumentTypeError: Number of processes must be at least 1
+  '''
+  processes = int(value)
+
+  if processes < 1:
+    raise argparse.ArgumentTypeError('Number of processes must be at least 1')
+
+  return processes
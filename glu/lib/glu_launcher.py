@@ -95,6 +95,24 @@ def run_profile(options,progmain):
       stats.print_stats(25)
       stats.print_callers(25)
 
+  elif options.profiler == 'sampling':
+    # Statistical profiling avoids the per-call tracing overhead of the
+    # deterministic profilers above
+    try:
+      from pyinstrument import Profiler
+    except ImportError:
+      raise GLUError('ERROR: Missing pyinstrument module for sampling profiler')
+
+    prof = Profiler()
+    prof.start()
+    try:
+      return progmain()
+    finally:
+      prof.stop()
+      # Draw the report with ASCII characters and encode it explicitly,
+      # since a redirected stderr only accepts ASCII text
+      sys.stderr.write(prof.output_text(unicode=False).encode('utf-8'))
+
   else:
     raise GLUError('ERROR: Unknown profiling option provided "%s"' % options.profiler)
 
@@ -150,7 +168,8 @@ def option_parser():
   devopts.add_argument('-p', '--profile', action='store_true',
                        help='Profile GLU code to find performance bottlenecks')
   devopts.add_argument('--profiler', metavar='P', default='python',
-                       help='Set the profiler to use when -p is specified')
+                       help='Set the profiler to use when -p is specified: python (default), hotshot '
+                            'or sampling (requires pyinstrument)')
   devopts.add_argument('--gcstats', action='store_true',
                        help='Generate statistics from the runtime object garbage collector')
   devopts.add_argument('--gcthreshold', metavar='N', type=int, default=1000000,
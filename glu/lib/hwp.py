@@ -8,10 +8,13 @@ __license__   = 'See GLU license for terms by running: glu license'
 __revision__  = '$Id$'
 
 
-from glu.lib.utils import izip_exact
+import numpy as np
+
+from   glu.lib.utils import izip_exact
 
 
 HWP_EXACT_THRESHOLD=8000
+HWP_VECTOR_THRESHOLD=256
 
 
 def hwp_exact_biallelic(hom1_count, het_count, hom2_count):
@@ -49,6 +52,10 @@ def hwp_exact_biallelic(hom1_count, het_count, hom2_count):
   0.18195180192910754
   >>> hwp_exact_biallelic(57, 184, 155)
   0.83102796343705576
+  >>> print '%.6g' % hwp_exact_biallelic(120, 400, 300)
+  0.509181
+  >>> print '%.6g' % hwp_exact_biallelic(300, 1500, 1200)
+  5.80492e-08
   '''
 
   # Computer the number of rare and common alleles
@@ -70,26 +77,47 @@ def hwp_exact_biallelic(hom1_count, het_count, hom2_count):
   hom_r = (rare-hets)/2
   hom_c = (common-hets)/2
 
-  # Initialize heterozygote probability vector, such that once filled in
-  # P(hets|observed counts) = probs[hets/2]/sum(probs)
-  probs = [0]*(rare//2+1)
+  # Short probability vectors are cheaper to fill in with scalar loops than
+  # with array operations
+  if rare < HWP_VECTOR_THRESHOLD:
+    # Initialize heterozygote probability vector, such that once filled in
+    # P(hets|observed counts) = probs[hets/2]/sum(probs)
+    probs = [0]*(rare//2+1)
+
+    # Set P(expected hets)=1, since the remaining probabilities will be
+    # computed relative to it
+    probs[hets//2] = 1.0
+
+    # Fill in relative probabilities for less than the expected hets
+    for i,h in enumerate(xrange(hets,1,-2)):
+      probs[h//2-1] = probs[h//2]*h*(h-1) / (4*(hom_r+i+1)*(hom_c+i+1))
 
-  # Set P(expected hets)=1, since the remaining probabilities will be
-  # computed relative to it
-  probs[hets//2] = 1.0
+    # Fill in relative probabilities for greater than the expected hets
+    for i,h in enumerate(xrange(hets,rare-1,2)):
+      probs[h//2+1] = probs[h//2]*4*(hom_r-i)*(hom_c-i) / ((h+1)*(h+2))
+
+    # Compute the pvalue by summing the probabilities <= to that of the
+    # observed number of heterozygotes and normalize by the total
+    p_obs  = probs[het_count//2]
+    pvalue = sum(p for p in probs if p <= p_obs)/sum(probs)
+
+  else:
+    # Relative probabilities for less than the expected hets, formed as the
+    # running product of the ratios between successive numbers of hets
+    h     = np.arange(hets,1,-2,dtype=float)
+    i     = np.arange(len(h))
+    down  = np.cumprod(h*(h-1) / (4*(hom_r+i+1)*(hom_c+i+1)))
 
-  # Fill in relative probabilities for less than the expected hets
-  for i,h in enumerate(xrange(hets,1,-2)):
-    probs[h//2-1] = probs[h//2]*h*(h-1) / (4*(hom_r+i+1)*(hom_c+i+1))
+    # Relative probabilities for greater than the expected hets
+    h     = np.arange(hets,rare-1,2,dtype=float)
+    i     = np.arange(len(h))
+    up    = np.cumprod(4*(hom_r-i)*(hom_c-i) / ((h+1)*(h+2)))
 
-  # Fill in relative probabilities for greater than the expected hets
-  for i,h in enumerate(xrange(hets,rare-1,2)):
-    probs[h//2+1] = probs[h//2]*4*(hom_r-i)*(hom_c-i) / ((h+1)*(h+2))
+    # Heterozygote probability vector relative to P(expected hets)=1
+    probs = np.concatenate( (down[::-1],[1.0],up) )
 
-  # Compute the pvalue by summing the probabilities <= to that of the
-  # observed number of heterozygotes and normalize by the total
-  p_obs = probs[het_count//2]
-  pvalue = sum(p for p in probs if p <= p_obs)/sum(probs)
+    p_obs  = probs[het_count//2]
+    pvalue = float(probs[probs<=p_obs].sum()/probs.sum())
 
   return pvalue
 
@@ -111,7 +139,7 @@ def hwp_chisq_biallelic(hom1_count, het_count, hom2_count):
   >>> hwp_chisq_biallelic(hom1_count, het_count, hom2_count)
   0.87188388159827424
   '''
-  import scipy.stats
+  from scipy.special import chdtrc
 
   n = hom1_count + het_count + hom2_count
 
@@ -128,7 +156,9 @@ def hwp_chisq_biallelic(hom1_count, het_count, hom2_count):
      +  score( het_count, 2*n*p*q)
      +  score(hom2_count,   n*q*q))
 
-  return float(scipy.stats.distributions.chi2.sf(xx,1))
+  # Upper tail of the chi-squared distribution with one degree of freedom,
+  # evaluated directly rather than through the generic scipy.stats machinery
+  return float(chdtrc(1,xx))
 
 
 def biallelic_counts(model,counts):
@@ -10,7 +10,7 @@ __revision__  = '$Id$'
 
 __all__ = ['as_set','is_str','tally','ilen','pair_generator','percent','xenumerate','pick',
            'peekfirst','groups','unique','izip_exact','LengthMismatch','deprecated','deprecated_by',
-           'gcdisabled','chunk']
+           'gcdisabled','chunk','pool_imap']
 
 import gc
 
@@ -201,7 +201,7 @@ def pair_generator(items):
   @param items: sequence of items
   @type  items: sequence
   @return     : distinct pairs of items
-  @rtype      : generator of tuples
+  @rtype      : iterator of tuples
 
   >>> pairs = pair_generator(['A','B','C'])
   >>> for item1,item2 in pairs:
@@ -212,10 +212,10 @@ def pair_generator(items):
   '''
   if not isinstance(items, (list,tuple)):
     items = list(items)
-  n = len(items)
-  for i in xrange(n):
-    for j in xrange(0,i):
-      yield items[i],items[j]
+
+  # Pair each item with all of the items before it, with the inner loop
+  # run by izip rather than by the interpreter
+  return chain.from_iterable( izip(repeat(item),islice(items,i)) for i,item in enumerate(items) )
 
 
 def percent(a,b):
@@ -953,6 +953,50 @@ def generator_thread(source, maxsize=1000, chunksize=1000):
   return genfrom_queue(q)
 
 
+# Function and shared state of each pool_imap worker process, set once when
+# the worker is started
+_pool_func  = None
+_pool_state = ()
+
+def _pool_init(func, state):
+  global _pool_func, _pool_state
+  _pool_func  = func
+  _pool_state = state
+
+
+def _pool_call(item):
+  return _pool_func(item, *_pool_state)
+
+
+def pool_imap(func, items, processes, state=(), queued=None):
+  '''
+  Generator that computes func(item, *state) for each of items using a pool
+  of worker processes and yields the results in input order.
+
+  The state is sent to each worker once, when the pool is created.  Only
+  queued items (default=2*processes) are submitted at a time, so that large
+  or lazily computed inputs are not consumed ahead of the results.  The
+  pool is terminated if the results are not consumed to completion.
+
+  >>> list(pool_imap(pow, range(5), 2, (2,)))
+  [0, 1, 4, 9, 16]
+  '''
+  from multiprocessing import Pool
+
+  pool = Pool(processes, initializer=_pool_init, initargs=(func,state))
+
+  try:
+    for group in chunk(items, queued or 2*processes):
+      for result in pool.imap(_pool_call, group):
+        yield result
+    pool.close()
+  except:
+    pool.terminate()
+    raise
+  finally:
+    pool.join()
+
+
 def lazy_property(fn):
   '''
   Return a lazily computed property.
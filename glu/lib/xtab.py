@@ -219,34 +219,48 @@ def xtab(data, rowkeyfunc=None, colkeyfunc=None, valuefunc=None,
 
   rowkeys  = dict( (rowkey,i) for i,rowkey in enumerate(roworder or []) )
   colkeys  = dict( (colkey,i) for i,colkey in enumerate(colorder or []) )
-  datalist = []
+  rowcells = [ {} for i in xrange(len(rowkeys)) ]
 
-  # Pass 1: Build row, column, and data list
+  # Pass 1: Build row and column keys and bucket values by row and column
   for row in data:
     rowkey = rowkeyfunc(row)
     colkey = colkeyfunc(row)
     value  = valuefunc(row)
     i=rowkeys.setdefault(rowkey, len(rowkeys))
     j=colkeys.setdefault(colkey, len(colkeys))
-    datalist.append( (i,j,value) )
+
+    if i==len(rowcells):
+      rowcells.append({})
+
+    cells = rowcells[i]
+    vs    = cells.get(j)
+
+    if vs is None:
+      cells[j] = [value]
+    else:
+      vs.append(value)
 
   # Invert and sort the row and column keys
   rowkeys = sorted(rowkeys.iteritems(), key=get1)
   colkeys = sorted(colkeys.iteritems(), key=get1)
 
-  datalist.sort()
-
   # Output column metadata
   columns = map(get0, colkeys)
   rows    = map(get0, rowkeys)
 
   def _xtab():
     # Pass 2: Build and yield result rows
-    for i,rowdata in groupby(datalist, get0):
-      row = [None]*len(colkeys)
+    n = len(colkeys)
+    for i,cells in enumerate(rowcells):
+      if not cells:
+        continue
+
+      row = [None]*n
 
-      for j,vs in groupby(rowdata, get1):
-        row[j] = map(get2, vs)
+      for j,vs in cells.iteritems():
+        if len(vs)>1:
+          vs.sort()
+        row[j] = vs
 
       if aggregatefunc:
         for colkey,j in colkeys:
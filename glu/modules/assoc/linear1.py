@@ -10,19 +10,27 @@ __revision__  = '$Id$'
 
 import sys
 
-import scipy.stats
+from   cStringIO           import StringIO
+
+import numpy as np
 
 from   numpy               import isfinite
+from   scipy.special       import chdtrc
 
+from   glu.lib.utils       import chunk,pool_imap
 from   glu.lib.fileutils   import autofile,hyphen,table_writer,table_options
-from   glu.lib.glm         import Linear,LinAlgError
+from   glu.lib.glm         import Linear,LinearPrefit,LinAlgError
 
 from   glu.lib.genolib     import geno_options
+from   glu.lib.genolib.genoarray import build_model,GenotypeArray,GenotypeArrayDescriptor
 from   glu.lib.association import build_models,print_results_linear,format_pvalue
 
 
+# Number of loci whose covariate cross-products are computed together
+LOCUS_BATCH_SIZE = 512
+
 def option_parser():
-  from glu.lib.glu_argparse import GLUArgumentParser
+  from glu.lib.glu_argparse import GLUArgumentParser,process_count
 
   parser = GLUArgumentParser(description=__abstract__)
 
@@ -63,6 +71,8 @@ def option_parser():
   analysis.add_argument('--allowdups', action='store_true', default=False,
                       help='Allow duplicate individuals in the data (e.g., to accommodate weighting '
                            'or incidence density sampling)')
+  analysis.add_argument('--processes', metavar='N', type=process_count, default=1,
+                      help='Number of worker processes used to fit loci in parallel (default=1)')
 
   output = parser.add_argument_group('Output options')
 
@@ -91,8 +101,8 @@ def check_R(model,g):
   from   numpy import array,allclose
 
   vars = [ v.replace(':','.').replace('+','p').replace('-','m').replace('_','.') for v in model.vars[1:] ]
-  frame = dict( (v,model.X[:,i+1].reshape(-1)) for i,v in enumerate(vars) )
-  frame['y'] = model.y.reshape(-1)
+  frame = dict( (v,np.asarray(model.X[:,i+1]).ravel()) for i,v in enumerate(vars) )
+  frame['y'] = np.asarray(model.y).ravel()
   formula = 'y ~ ' + ' + '.join(v.replace(':','.') for v in vars)
 
   rpy.set_default_mode(rpy.NO_CONVERSION)
@@ -102,84 +112,98 @@ def check_R(model,g):
 
   coef  = r.coefficients(mod)
   coef  = array([coef['(Intercept)']] + [ coef[v] for v in vars ],dtype=float)
-  coef2 = g.beta.reshape(-1)
+  coef2 = np.asarray(g.beta).ravel()
 
-  #assert allclose(coef,g.beta.reshape(-1),atol=1e-6)
+  #assert allclose(coef,coef2,atol=1e-6)
   #assert allclose(r.vcov(mod),g.W,atol=1e-6)
 
 
-def summary_header(options):
-  ci = int(100*options.ci) if options.ci else None
+def batch_cross_products(prefit,null_model,models):
+  '''
+  Compute the cross-products between the covariates and the genotype
+  effects of a batch of per-locus models using a single matrix product.
 
-  header = ['Locus', 'Alleles', 'MAF', 'Geno Counts', 'Subjects']
+  Returns a list aligned with models of (covariates,drop,cross) tuples, as
+  required by Linear.fit_with_covariate_prefit, or None for any model where
+  the prefit cannot be used.
+  '''
+  if prefit is None:
+    return [None]*len(models)
 
-  if 'score' in options.stats:
-    header += ['score X2', 'score p-value']
-  if 'wald' in options.stats:
-    header += ['Wald X2',  'Wald p-value' ]
-  if 'lrt' in options.stats:
-    header += ['LR X2',    'LR p-value'   ]
-  if options.stats:
-    header += ['df']
+  designs = []
+  blocks  = []
+  m       = len(prefit.y)
 
-  # FIXME: SEs are optional
-  for name in options.display.effect_names():
-    if name.startswith('locus:'):
-      name = name[6:]
-    header += [ '%s' % name ]
-    if options.se:
-      header += [ '%s SE' % name ]
-    if ci:
-      header += [ '%s %d%% CI_l' % (name,ci),
-                  '%s %d%% CI_u' % (name,ci) ]
+  for model in models:
+    try:
+      covariates = [ model.vars.index(v) for v in null_model.vars ]
+    except ValueError:
+      designs.append(None)
+      continue
 
-  return header
+    drop = ~model.mask[null_model.mask]
+    keep = ~drop
 
+    if keep.sum() != len(model.y):
+      designs.append(None)
+      continue
 
-def main():
-  parser  = option_parser()
-  options = parser.parse_args()
-  phenos  = options.phenotypes
-  genos   = options.genotypes
+    # Expand genotype effects to the rows of the null model.  Dropped rows
+    # are zero and so do not contribute to the cross-products.
+    other       = np.setdiff1d(np.arange(model.X.shape[1]),covariates)
+    G           = np.zeros( (m,len(other)), dtype=float )
+    G[keep]     = model.X[:,other]
 
-  if not (0<=options.ci<=1):
-    parser.error('Confidence interval must be between 0 and 1')
+    designs.append( (covariates,drop) )
+    blocks.append(G)
 
-  out = table_writer(options.output,hyphen=sys.stdout)
-  if options.details:
-    details = autofile(hyphen(options.details,sys.stdout),'w')
-    if details is out:
-      parser.error('Summary and detailed output cannot both be sent to stdout')
+  crosses = iter(prefit.cross_products_batch(blocks))
 
-  loci,fixedloci,gterms,models = build_models(phenos, genos, options, deptype=float)
+  return [ design+(next(crosses),) if design else None for design in designs ]
 
-  if options.details:
-    details.write('NULL MODEL:\n\n')
 
-    null_model = models.build_model(options.null,fixedloci)
+def fit_model(g,prefit,design):
+  '''
+  Fit a per-locus model, reusing the covariate cross-products computed for
+  the null model when possible and falling back to a full fit otherwise
+  '''
+  if design is not None:
+    covariates,drop,cross = design
+    try:
+      return g.fit_with_covariate_prefit(prefit,covariates,drop,cross)
+    except (ValueError,LinAlgError):
+      pass
 
-    if not null_model or not null_model.valid(minmaf=options.minmaf, mingenos=options.mingenos):
-      raise ValueError('Cannot construct null model')
+  return g.fit()
 
-    # Obtain estimates of covariate effects under the null
-    null = Linear(null_model.y,null_model.X,vars=null_model.vars)
-    null.fit()
 
-    print_results_linear(details,null_model,null)
+def fit_batch(batch,options,fixedloci,gterms,models,null_model,prefit,details=None):
+  '''
+  Fit the models for a batch of loci and return their summary rows
 
-  if not genos:
-    return
+  Batching allows the cross-products between the genotype effects and
+  covariates of many loci to be computed using a single matrix product.
+  Detailed results are written to details, if requested.
+  '''
+  stats_score   = 'score' in options.stats
+  stats_wald    = 'wald'  in options.stats
+  stats_lrt     = 'lrt'   in options.stats
+  odds_ratios   = options.display.odds_ratios
+  std_errors    = options.display.standard_errors
+  odds_ratio_ci = options.display.odds_ratio_ci
 
-  header = summary_header(options)
-  out.writerow(header)
+  # Term indices are assigned when the first model is built and depend only
+  # on the formula, so they are the same for every locus in the batch
+  test_indices  = None
 
-  # For each locus
-  for lname,genos in loci:
+  fits = []
+
+  for lname,genos in batch:
     result = [lname]
+    fits.append( (lname,result,None) )
 
     # Skip fixed terms
     if lname in fixedloci:
-      out.writerow(result)
       continue
 
     lmap = fixedloci.copy()
@@ -191,7 +215,6 @@ def main():
     model = models.build_model(options.model,lmap)
 
     if not model:
-      out.writerow(result)
       continue
 
     m = model.model_loci[lname]
@@ -203,15 +226,27 @@ def main():
                str(n) ]
 
     if not model.valid(minmaf=options.minmaf, mingenos=options.mingenos):
-      out.writerow(result)
       continue
 
+    fits[-1] = (lname,result,model)
+
+  designs = iter(batch_cross_products(prefit,null_model,[ model for lname,result,model in fits if model ]))
+
+  # Summary rows for the batch are written together once it is complete
+  rows = [ result for lname,result,model in fits ]
+
+  for lname,result,model in fits:
+    if not model:
+      continue
+
+    for t in gterms:
+      t.name = lname
+
     g = Linear(model.y,model.X,vars=model.vars)
 
     try:
-      g.fit()
+      fit_model(g,prefit,next(designs))
     except LinAlgError:
-      out.writerow(result)
       continue
 
     # Design matrix debugging output
@@ -225,47 +260,48 @@ def main():
       check_R(model,g)
 
     # Construct genotype parameter indices
-    test_indices = options.test.indices()
+    if test_indices is None:
+      test_indices = options.test.indices()
 
     sp = wp = lp = None
     df = None
 
-    if 'score' in options.stats:
+    if stats_score:
       try:
         st,df = g.score_test(indices=test_indices).test()
       except LinAlgError:
         result.extend( ['',''] )
       else:
-        sp    = scipy.stats.distributions.chi2.sf(st,df)
+        sp    = chdtrc(df,st)
         sps   = format_pvalue(sp)
         result.extend( ['%.5f' % st, sps ] )
 
-    if 'wald' in options.stats:
+    if stats_wald:
       try:
         wt,df = g.wald_test(indices=test_indices).test()
       except LinAlgError:
         result.extend( ['',''] )
       else:
-        wp    = scipy.stats.distributions.chi2.sf(wt,df)
+        wp    = chdtrc(df,wt)
         wps   = format_pvalue(wp)
         result.extend( ['%.5f' % wt, wps ] )
 
-    if 'lrt' in options.stats:
+    if stats_lrt:
       try:
         lt,df = g.lr_test(indices=test_indices).test()
       except LinAlgError:
         result.extend( ['',''] )
       else:
-        lp    = scipy.stats.distributions.chi2.sf(lt,df)
+        lp    = chdtrc(df,lt)
         lps   = format_pvalue(lp)
         result.extend( ['%.5f' % lt, lps ] )
 
     if options.stats:
       result.append(df)
 
-    ors  = options.display.odds_ratios(g.beta)
-    ses  = options.display.standard_errors(g.W)
-    cis  = options.display.odds_ratio_ci(g.beta,g.W,alpha=options.ci)
+    ors  = odds_ratios(g.beta)
+    ses  = std_errors(g.W)
+    cis  = odds_ratio_ci(g.beta,g.W,alpha=options.ci)
 
     res = []
     for i in range(len(ors)):
@@ -277,8 +313,6 @@ def main():
 
     result.extend('%.4f' % e if isfinite(e) else '' for e in res)
 
-    out.writerow(result)
-
     if options.details and min(sp,wp,lp) <= options.detailsmaxp:
       details.write('\nRESULTS: %s\n\n' % lname)
       print_results_linear(details,model,g)
@@ -286,17 +320,180 @@ def main():
       if options.stats:
         details.write('Testing: %s\n\n' % options.test.formula())
 
-      if 'score' in options.stats and sp is not None:
+      if stats_score and sp is not None:
         details.write('Score test           : X2=%9.5f, df=%d, p=%s\n' % (st,df,sps))
-      if 'wald' in options.stats and wp is not None:
+      if stats_wald and wp is not None:
         details.write('Wald test            : X2=%9.5f, df=%d, p=%s\n' % (wt,df,wps))
-      if 'lrt' in options.stats and lp is not None:
+      if stats_lrt and lp is not None:
         details.write('Likelihood ratio test: X2=%9.5f, df=%d, p=%s\n' % (lt,df,lps))
 
       details.write('\n')
       details.write('-'*79)
       details.write('\n')
 
+  return rows
+
+
+def pack_genos(batch):
+  '''
+  Convert a batch of loci into a picklable form that can be sent to a
+  worker process
+
+  Genotypes of a locus that are not in a GenotypeArray may refer to
+  earlier, smaller versions of the locus model, so the union of the alleles
+  of all of their models is sent.
+
+  >>> m1 = build_model('G',max_alleles=2)
+  >>> m2 = build_model('GA',max_alleles=2)
+  >>> genos = [m1['G','G'],m2['A','G'],m2[None,None],m2['A','A']]
+  >>> for lname,genos in unpack_genos(pack_genos([('rs1',genos)])):
+  ...   print lname,genos[0].model.alleles,[ g.alleles() for g in genos ]
+  rs1 [None, 'A', 'G'] [('G', 'G'), ('A', 'G'), (None, None), ('A', 'A')]
+  '''
+  packed = []
+  for lname,genos in batch:
+    if isinstance(genos,GenotypeArray):
+      model            = genos[0].model
+      alleles          = model.alleles[1:]
+      max_alleles      = model.max_alleles
+      allow_hemizygote = model.allow_hemizygote
+      genos            = genos.tolist()
+    else:
+      models  = dict( (id(g.model),g.model) for g in genos ).values()
+      models.sort(key=lambda m: len(m.alleles),reverse=True)
+
+      alleles = []
+      for model in models:
+        for a in model.alleles[1:]:
+          if a not in alleles:
+            alleles.append(a)
+
+      max_alleles      = max(len(alleles),max(m.max_alleles for m in models))
+      allow_hemizygote = any(m.allow_hemizygote for m in models)
+      genos            = [ g.alleles() for g in genos ]
+
+    packed.append( (lname,alleles,max_alleles,allow_hemizygote,genos) )
+  return packed
+
+
+def unpack_genos(packed):
+  '''
+  Rebuild a batch of loci from the form produced by pack_genos
+  '''
+  batch = []
+  for lname,alleles,max_alleles,allow_hemizygote,genos in packed:
+    model = build_model(alleles,max_alleles=max_alleles,allow_hemizygote=allow_hemizygote)
+    descr = GenotypeArrayDescriptor([model]*len(genos))
+    batch.append( (lname,GenotypeArray(descr,genos)) )
+  return batch
+
+
+def fit_packed_batch(packed,options,fixedloci,gterms,models,null_model,prefit):
+  '''
+  Fit a packed batch of loci in a worker process and return the summary
+  rows and text of the detailed results
+  '''
+  details = StringIO() if options.details else None
+  rows    = fit_batch(unpack_genos(packed),options,fixedloci,gterms,models,null_model,prefit,
+                      details=details)
+
+  return rows,details.getvalue() if details else ''
+
+
+def fit_batches_parallel(out,details,loci,options,fixedloci,gterms,models,null_model,prefit):
+  '''
+  Fit batches of loci using a pool of worker processes
+
+  The covariate cross-products, fixed loci and parsed models are shared
+  with each worker once, when the pool is created.  Results are written in
+  input order.
+  '''
+  state   = (options,fixedloci,gterms,models,null_model,prefit)
+  batches = ( pack_genos(batch) for batch in chunk(loci,LOCUS_BATCH_SIZE) )
+
+  for rows,text in pool_imap(fit_packed_batch,batches,options.processes,state):
+    out.writerows(rows)
+    if text:
+      details.write(text)
+
+
+def summary_header(options):
+  ci = int(100*options.ci) if options.ci else None
+
+  header = ['Locus', 'Alleles', 'MAF', 'Geno Counts', 'Subjects']
+
+  if 'score' in options.stats:
+    header += ['score X2', 'score p-value']
+  if 'wald' in options.stats:
+    header += ['Wald X2',  'Wald p-value' ]
+  if 'lrt' in options.stats:
+    header += ['LR X2',    'LR p-value'   ]
+  if options.stats:
+    header += ['df']
+
+  # FIXME: SEs are optional
+  for name in options.display.effect_names():
+    if name.startswith('locus:'):
+      name = name[6:]
+    header += [ '%s' % name ]
+    if options.se:
+      header += [ '%s SE' % name ]
+    if ci:
+      header += [ '%s %d%% CI_l' % (name,ci),
+                  '%s %d%% CI_u' % (name,ci) ]
+
+  return header
+
+
+def main():
+  parser  = option_parser()
+  options = parser.parse_args()
+  phenos  = options.phenotypes
+  genos   = options.genotypes
+
+  if not (0<=options.ci<=1):
+    parser.error('Confidence interval must be between 0 and 1')
+
+  out     = table_writer(options.output,hyphen=sys.stdout)
+  details = None
+  if options.details:
+    details = autofile(hyphen(options.details,sys.stdout),'w')
+    if details is out:
+      parser.error('Summary and detailed output cannot both be sent to stdout')
+
+  loci,fixedloci,gterms,models = build_models(phenos, genos, options, deptype=float)
+
+  # Covariate effects are shared by all per-locus models, so their
+  # cross-products are computed once from the null model
+  null_model = models.build_model(options.null,fixedloci)
+  prefit     = LinearPrefit(null_model.y,null_model.X) if null_model else None
+
+  if options.details:
+    details.write('NULL MODEL:\n\n')
+
+    if not null_model or not null_model.valid(minmaf=options.minmaf, mingenos=options.mingenos):
+      raise ValueError('Cannot construct null model')
+
+    # Obtain estimates of covariate effects under the null
+    null = Linear(null_model.y,null_model.X,vars=null_model.vars)
+    null.fit()
+
+    print_results_linear(details,null_model,null)
+
+  if not genos:
+    return
+
+  header = summary_header(options)
+  out.writerow(header)
+
+  if options.processes > 1:
+    fit_batches_parallel(out,details,loci,options,fixedloci,gterms,models,null_model,prefit)
+    return
+
+  for batch in chunk(loci,LOCUS_BATCH_SIZE):
+    rows = fit_batch(batch,options,fixedloci,gterms,models,null_model,prefit,details)
+    out.writerows(rows)
+
 
 if __name__ == '__main__':
   main()
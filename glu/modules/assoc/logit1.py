@@ -13,9 +13,9 @@ import sys
 from   itertools           import izip
 
 import numpy as np
-import scipy.stats
 
 from   numpy               import zeros,isfinite,hstack
+from   scipy.special       import chdtrc
 
 from   glu.lib.fileutils   import autofile,hyphen,table_writer,table_options
 from   glu.lib.glm         import GLogit,LinAlgError
@@ -66,6 +66,11 @@ def option_parser():
   analysis.add_argument('--allowdups', action='store_true', default=False,
                       help='Allow duplicate individuals in the data (e.g., to accommodate weighting '
                            'or incidence density sampling)')
+  analysis.add_argument('--fasttests', metavar='P', type=float,
+                      help='Fit the full model and compute Wald and likelihood ratio statistics only for loci with a score test p-value '
+                           'no greater than P (or the --detailsmaxp threshold, if larger and detailed results are output).  Other loci have '
+                           'these statistics and effect estimates left blank, and no detailed output, even if their '
+                           'Wald or likelihood ratio p-value would have qualified for it.  Requires score statistics.')
 
   output = parser.add_argument_group('Output options')
 
@@ -172,6 +177,9 @@ def main():
   if not (0<=options.ci<=1):
     parser.error('Confidence interval must be between 0 and 1')
 
+  if options.fasttests is not None and not (0<=options.fasttests<=1):
+    parser.error('Fast test p-value threshold must be between 0 and 1')
+
   out = table_writer(options.output,hyphen=sys.stdout)
   if options.details:
     details = autofile(hyphen(options.details,sys.stdout),'w')
@@ -180,6 +188,18 @@ def main():
 
   loci,fixedloci,gterms,models = build_models(phenos, genos, options)
 
+  if options.fasttests is not None and 'score' not in options.stats:
+    parser.error('Fast tests require score statistics')
+
+  # The full model is not fit and the Wald and likelihood ratio tests are
+  # skipped for loci with score test p-values above this threshold.  Loci
+  # whose score p-value qualifies for detailed output are never screened,
+  # but screened loci lose detailed output that their Wald or likelihood
+  # ratio p-values alone would have qualified them for.
+  fastmaxp = options.fasttests
+  if fastmaxp is not None and options.details:
+    fastmaxp = max(fastmaxp,options.detailsmaxp)
+
   null_model = models.build_model(options.null,fixedloci)
 
   if not null_model or not null_model.valid(minmaf=options.minmaf, mingenos=options.mingenos):
@@ -207,6 +227,21 @@ def main():
   header = summary_header(options,null)
   out.writerow(header)
 
+  stats_score   = 'score' in options.stats
+  stats_wald    = 'wald'  in options.stats
+  stats_lrt     = 'lrt'   in options.stats
+  detailsmaxp   = options.detailsmaxp if options.details else None
+  odds_ratios   = options.display.odds_ratios
+  std_errors    = options.display.standard_errors
+  odds_ratio_ci = options.display.odds_ratio_ci
+
+  ncats         = len(null.categories)
+  phenomap      = dict( (c,i) for i,c in enumerate(null.categories) )
+
+  # Placeholder estimates for categories not observed at a locus
+  missing       = np.empty(1+bool(options.se)+2*bool(options.ci), dtype=float)
+  missing.fill(np.nan)
+
   # For each locus
   for lname,genos in loci:
     result = [lname]
@@ -235,12 +270,13 @@ def main():
       out.writerow(result)
       continue
 
-    counts   = zeros( (len(null.categories),3), dtype=int )
-    phenomap = dict( (c,i) for i,c in enumerate(null.categories) )
+    counts = zeros( (ncats,3), dtype=int )
     if len(base.y.flat) and len(base.X.flat):
-      for pheno,geno in izip(base.y[:,0],base.X[:,0]):
-        pindex = phenomap[pheno]
-        counts[pindex,geno] += 1
+      # Map each distinct phenotype to its category once, then count
+      # phenotype/genotype pairs in a single pass
+      phenos,pindex = np.unique(base.y[:,0], return_inverse=True)
+      pindex = np.array([ phenomap[pheno] for pheno in phenos ], dtype=int)[pindex]
+      counts = np.bincount(3*pindex+base.X[:,0].astype(int), minlength=3*ncats).reshape(ncats,3)
 
     mafs = (counts*[0.,0.5,1.]).sum(axis=1)/counts.sum(axis=1)
     mafs[~isfinite(mafs)] = 0
@@ -259,20 +295,8 @@ def main():
 
     g = GLogit(model.y,model.X,vars=model.vars)
 
-    try:
-      g.fit()
-    except LinAlgError:
-      out.writerow(result)
-      continue
-
-    # Design matrix debugging output
-    if 0:
-      dump_model('%s.csv' % lname, model)
-      sys.exit(1)
-
-    # R model verification debugging code
-    if 0:
-      check_R(model,g)
+    # Share the null model fit with the score and likelihood ratio tests
+    g.null_fit = null
 
     assert len(null.categories) >= len(g.categories)
 
@@ -284,77 +308,104 @@ def main():
 
     sp = wp = lp = None
     df = ''
+    nbase = len(result)
 
-    if 'score' in options.stats:
+    if stats_score:
       try:
         st,df = g.score_test(indices=test_indices).test()
       except LinAlgError:
         result.extend( ['',''] )
       else:
-        sp    = scipy.stats.distributions.chi2.sf(st,df)
+        sp    = chdtrc(df,st)
         sps   = format_pvalue(sp)
         result.extend( ['%.5f' % st, sps ] )
 
-    if 'wald' in options.stats:
+    # The score test requires only the null model fit and is a sharp screen
+    # for the Wald and likelihood ratio tests, which are asymptotically
+    # equivalent but require fitting the full model
+    if fastmaxp is not None and sp is not None and sp > fastmaxp:
+      result.extend( ['','']*(stats_wald+stats_lrt) )
+      result.append(df)
+      out.writerow(result)
+      continue
+
+    try:
+      g.fit()
+    except LinAlgError:
+      out.writerow(result[:nbase])
+      continue
+
+    # Design matrix debugging output
+    if 0:
+      dump_model('%s.csv' % lname, model)
+      sys.exit(1)
+
+    # R model verification debugging code
+    if 0:
+      check_R(model,g)
+
+    if stats_wald:
       try:
         wt,df = g.wald_test(indices=test_indices).test()
       except LinAlgError:
         result.extend( ['',''] )
       else:
-        wp    = scipy.stats.distributions.chi2.sf(wt,df)
+        wp    = chdtrc(df,wt)
         wps   = format_pvalue(wp)
         result.extend( ['%.5f' % wt, wps ] )
 
-    if 'lrt' in options.stats:
+    if stats_lrt:
       try:
         lt,df = g.lr_test(indices=test_indices).test()
       except LinAlgError:
         result.extend( ['',''] )
       else:
-        lp    = scipy.stats.distributions.chi2.sf(lt,df)
+        lp    = chdtrc(df,lt)
         lps   = format_pvalue(lp)
         result.extend( ['%.5f' % lt, lps ] )
 
     if options.stats:
       result.append(df)
 
-    res = []
+    # Estimates for each category are assembled as rows of (OR, SE, CI_l,
+    # CI_u) per effect and flattened, so that they are output interleaved
+    res   = []
+    gcats = list(g.categories)
     for categ in null.categories[1:]:
       try:
-        cat  = g.categories.tolist().index(categ)-1
+        cat  = gcats.index(categ)-1
       except ValueError:
-        res += ['']*(1+bool(options.se)+2*bool(options.ci))
+        res.append(missing)
       else:
         beta = g.beta[cat*n:(cat+1)*n,0]
         W    = g.W[cat*n:(cat+1)*n,:][:,cat*n:(cat+1)*n]
 
-        ors  = options.display.odds_ratios(beta)
-        ses  = options.display.standard_errors(W)
-        cis  = options.display.odds_ratio_ci(beta,W,alpha=options.ci)
+        cols = [ odds_ratios(beta) ]
+        if options.se:
+          cols.append(std_errors(W))
+        if options.ci:
+          cols.extend(odds_ratio_ci(beta,W,alpha=options.ci).T)
 
-        for i in range(len(ors)):
-          res.append(ors[i])
-          if options.se:
-            res.append(ses[i])
-          if options.ci:
-            res += list(cis[i])
+        res.append(np.column_stack(cols).ravel())
 
-    result.extend('%.4f' % v if isfinite(v) else '' for v in res)
+    if res:
+      res = np.concatenate(res)
+      result.extend('%.4f' % v if f else '' for v,f in izip(res.tolist(),isfinite(res).tolist()))
 
     out.writerow(result)
 
-    if options.details and min(sp,wp,lp) <= options.detailsmaxp:
+    if detailsmaxp is not None and min(sp,wp,lp) <= detailsmaxp:
       details.write('\nRESULTS: %s\n\n' % lname)
       print_results(details,model,g)
 
       if options.stats:
         details.write('Testing: %s\n\n' % options.test.formula())
 
-      if 'score' in options.stats and sp is not None:
+      if stats_score and sp is not None:
         details.write('Score test           : X2=%9.5f, df=%d, p=%s\n' % (st,df,sps))
-      if 'wald' in options.stats and wp is not None:
+      if stats_wald and wp is not None:
         details.write('Wald test            : X2=%9.5f, df=%d, p=%s\n' % (wt,df,wps))
-      if 'lrt' in options.stats and lp is not None:
+      if stats_lrt and lp is not None:
         details.write('Likelihood ratio test: X2=%9.5f, df=%d, p=%s\n' % (lt,df,lps))
 
       details.write('\n')
@@ -9,13 +9,19 @@ __revision__  = '$Id$'
 
 import sys
 
+from   glu.lib.utils          import chunk
 from   glu.lib.fileutils      import table_reader,table_writer,tryint
 
 from   glu.lib.genedb         import open_genedb
 from   glu.lib.genedb.queries import query_genes_by_name, query_snps_by_name, query_cytoband_by_name, \
-                                     query_contig_by_name, query_cytobands_by_location
+                                     query_contig_by_name, query_cytobands_by_location, \
+                                     query_genes_by_names, query_snps_by_names, query_cytobands_by_names, \
+                                     query_contigs_by_names
 
 
+# Number of features whose names are looked up together
+FEATURE_BATCH_SIZE = 500
+
 HEADER = ['FEATURE_NAME','CHROMOSOME','CYTOBAND','STRAND','FEATURE_START','FEATURE_END','BASES_UP',
           'BASES_DOWN','SNPS_UP','SNPS_DOWN','FEATURE_TYPE']
 
@@ -55,7 +61,29 @@ def is_int(i):
   return isinstance(i, (int,long))
 
 
-def resolve_feature(con,feature,options):
+def prefetch_features(con,names):
+  '''
+  Look up a batch of feature names in bulk.  Each table is only searched for
+  names that are not resolved by the tables that resolve_feature consults
+  before it.  Name patterns are left to be queried individually.
+  '''
+  names     = set( name for name in names if '%' not in name )
+
+  genes     = query_genes_by_names(con,names)
+  names     = [ name for name in names if not genes[name] ]
+
+  cytobands = query_cytobands_by_names(con,names)
+  names     = [ name for name in names if not cytobands[name] and 'p' not in name and 'q' not in name ]
+
+  contigs   = query_contigs_by_names(con,names)
+  names     = [ name for name in names if not contigs[name] ]
+
+  snps      = query_snps_by_names(con,names)
+
+  return genes,cytobands,contigs,snps
+
+
+def resolve_feature(con,feature,options,prefetched=None):
   name        = feature[0]
   chrom       = feature[1] or None
   strand      = feature[2] or '+'
@@ -66,6 +94,8 @@ def resolve_feature(con,feature,options):
   upsnps      = coalesce(tryint(feature[7]), options.upsnps)
   downsnps    = coalesce(tryint(feature[8]), options.downsnps)
 
+  genes,cytobands,contigs,snps = prefetched or ({},{},{},{})
+
   found = False
 
   if (start is not None and end is None) or (is_int(start) and is_int(end) and start+1==end):
@@ -74,14 +104,18 @@ def resolve_feature(con,feature,options):
 
   if not found and chrom and start and end:
     found = True
-    geneinfo = query_genes_by_name(con,name)
+    geneinfo = genes.get(name)
+    if geneinfo is None:
+      geneinfo = query_genes_by_name(con,name)
     if any( (chrom,start,end) == (gi[2],gi[3],gi[4]) for gi in geneinfo):
       feature = 'GENE'
     else:
       feature = 'REGION'
 
   if not found:
-    geneinfo = query_genes_by_name(con,name)
+    geneinfo = genes.get(name)
+    if geneinfo is None:
+      geneinfo = query_genes_by_name(con,name)
     if len(geneinfo) == 1:
       name,chrom,start,end,strand = geneinfo[0][1:6]
       feature = geneinfo[0][6]
@@ -91,7 +125,7 @@ def resolve_feature(con,feature,options):
       found = True
 
   if not found:
-    cytoinfo = query_cytoband_by_name(con,name)
+    cytoinfo = query_cytoband_by_name(con,name,cytobands.get(name))
     if cytoinfo:
       chrom,start,end,color = cytoinfo
       strand = '+'
@@ -99,7 +133,7 @@ def resolve_feature(con,feature,options):
       found = True
 
   if not found:
-    contiginfo = query_contig_by_name(con,name)
+    contiginfo = query_contig_by_name(con,name,contigs.get(name))
     if contiginfo:
       chrom,start,end = contiginfo
       strand = '+'
@@ -107,7 +141,9 @@ def resolve_feature(con,feature,options):
       found = True
 
   if not found:
-    snpinfo = query_snps_by_name(con,name)
+    snpinfo = snps.get(name)
+    if snpinfo is None:
+      snpinfo = query_snps_by_name(con,name)
     if len(snpinfo)==1:
       name,chrom,start,end,strand,refAllele,alleles,vclass,func,weight = snpinfo[0]
       feature = 'SNP'
@@ -126,9 +162,12 @@ def resolve_feature(con,feature,options):
 
 
 def resolve_features(con,features,options):
-  for feature in features:
-    feature += [None]*(10-len(feature))
-    yield resolve_feature(con,feature,options)
+  for batch in chunk(features,FEATURE_BATCH_SIZE):
+    batch      = [ feature+[None]*(10-len(feature)) for feature in batch ]
+    prefetched = prefetch_features(con,[ feature[0] for feature in batch ])
+
+    for feature in batch:
+      yield resolve_feature(con,feature,options,prefetched)
 
 
 def bed_format(results):
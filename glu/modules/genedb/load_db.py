@@ -528,6 +528,9 @@ def load_cytobands(con,bands):
   sql = 'CREATE INDEX idx_cytoband ON CYTOBAND (chrom,start,stop);'
   cur.execute(sql)
 
+  sql = 'CREATE INDEX idx_cytoband_band ON CYTOBAND (band);'
+  cur.execute(sql)
+
   con.commit()
 
 
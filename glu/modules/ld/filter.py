@@ -11,7 +11,9 @@ __revision__  = '$Id$'
 
 import sys
 
+from   bisect                    import bisect_left, bisect_right
 from   itertools                 import islice
+from   collections               import defaultdict
 
 from   glu.lib.fileutils         import table_reader, table_writer, resolve_column_header
 
@@ -58,12 +60,81 @@ def option_parser():
   return parser
 
 
-def close(loc1,loc2,maxdist):
-  chr1,loc1 = loc1.chromosome,loc1.location
-  chr2,loc2 = loc2.chromosome,loc2.location
-  if None in (chr1,chr2,loc1,loc2):
-    return True
-  return chr1==chr2 and abs(loc1-loc2) <= maxdist
+class TakenLoci(object):
+  '''
+  Sequence of taken loci, indexed by chromosome and location so that the
+  loci near a given locus can be found without scanning all of them.  Loci
+  with an unknown chromosome or location are considered near all others.
+
+  >>> from glu.lib.genolib.locus import Locus
+  >>> taken = TakenLoci()
+  >>> taken.append('l1',Locus('l1',chromosome='1',location=1000))
+  >>> taken.append('l2',Locus('l2',chromosome='1',location=5000))
+  >>> taken.append('l3',Locus('l3'))
+  >>> taken.append('l4',Locus('l4',chromosome='2',location=1000))
+  >>> taken.append('l5',Locus('l5',chromosome='1',location=2000))
+  >>> len(taken)
+  5
+  >>> taken.near(Locus('l6',chromosome='1',location=1500),1000)
+  ['l1', 'l3', 'l5']
+  >>> taken.near(Locus('l6',chromosome='1',location=4000),1000)
+  ['l2', 'l3']
+  >>> taken.near(Locus('l6',chromosome='3',location=4000),1000)
+  ['l3']
+  >>> taken.near(Locus('l6',chromosome='1'),1000)
+  ['l1', 'l2', 'l3', 'l4', 'l5']
+  '''
+  def __init__(self):
+    self.loci      = []
+    self.locations = defaultdict(list)
+    self.entries   = defaultdict(list)
+    self.unplaced  = []
+
+  def __len__(self):
+    return len(self.loci)
+
+  def append(self,locus,loc):
+    '''
+    Add a taken locus with the given Locus descriptor
+    '''
+    entry = len(self.loci),locus
+    self.loci.append(locus)
+
+    chrom,pos = loc.chromosome,loc.location
+
+    if chrom is None or pos is None:
+      self.unplaced.append(entry)
+    else:
+      locations = self.locations[chrom]
+      i = bisect_right(locations,pos)
+      locations.insert(i,pos)
+      self.entries[chrom].insert(i,entry)
+
+  def near(self,loc,maxdist):
+    '''
+    Return the taken loci within maxdist bases of the given Locus
+    descriptor, in the order in which they were taken
+    '''
+    chrom,pos = loc.chromosome,loc.location
+
+    if chrom is None or pos is None:
+      return list(self.loci)
+
+    locations = self.locations.get(chrom)
+
+    if not locations:
+      window = []
+    else:
+      start  = bisect_left(locations,pos-maxdist)
+      stop   = bisect_right(locations,pos+maxdist)
+      window = self.entries[chrom][start:stop]
+
+    if self.unplaced:
+      window.extend(self.unplaced)
+
+    window.sort()
+
+    return [ locus for i,locus in window ]
 
 
 def main():
@@ -87,19 +158,17 @@ def main():
   if options.limit:
     rows = islice(rows,options.limit)
 
-  if pindex>=0 and take1p<1.0:
-    snps = set()
-    new_rows = []
-    for row in rows:
-      pval = float(row[pindex] or 1.0)
-      if pval>take1p:
-        break
-      new_rows.append(row)
-      snps.add(row[lindex])
-    rows = new_rows
-  else:
-    rows   = list(rows)
-    snps   = set(row[lindex] for row in rows)
+  # Read candidate loci in a single pass, stopping at the first row that
+  # fails the one-hit p-value threshold
+  checkp   = pindex>=0 and take1p<1.0
+  snps     = set()
+  new_rows = []
+  for row in rows:
+    if checkp and float(row[pindex] or 1.0)>take1p:
+      break
+    new_rows.append(row)
+    snps.add(row[lindex])
+  rows = new_rows
 
   genos  = load_genostream(options.genotypes,format=options.informat,genorepr=options.ingenorepr,
                            genome=options.loci,phenome=options.pedigree,
@@ -111,7 +180,7 @@ def main():
 
   out.writerow(header+['LDFILTER_RANK','LDFILTER_RANK_TAKEN','LDFILTER_TAKEN','LDFILTER_REASON','LDFILTER_DETAILS'])
 
-  taken       = []
+  taken       = TakenLoci()
   takenset    = set()
   twohitset   = set()
   twohit      = 0
@@ -164,12 +233,8 @@ def main():
     near  = []
     snpld = []
 
-    for tlocus in taken:
+    for tlocus in taken.near(loc,maxdist):
       tgeno = genos[tlocus]
-      tloc  = genome.get_locus(tlocus)
-
-      if not close(loc,tloc,maxdist):
-        continue
 
       near.append(tlocus)
 
@@ -183,18 +248,18 @@ def main():
     hits2 &= twohitset
 
     if not near:
-      taken.append(locus)
+      taken.append(locus,loc)
       takenset.add(locus)
       out.writerow(row+[i+1,len(taken), 'TAKE', 'No SNPs nearby when selected', ''])
     elif not snpld:
-      taken.append(locus)
+      taken.append(locus,loc)
       takenset.add(locus)
       if pval<=take2p:
         twohitset.add(locus)
       out.writerow(row+[i+1,len(taken), 'TAKE', 'Below LD threshold', '%d SNPs nearby' % len(near)])
     elif hits2:
       twohit += 1
-      taken.append(locus)
+      taken.append(locus,loc)
       takenset.add(locus)
       twohitset -= hits2
       hits2 = ','.join(sorted(hits2))
@@ -23,24 +23,26 @@ __license__   = 'See GLU license for terms by running: glu license'
 __revision__  = '$Id$'
 
 
-import re
 import sys
 import copy
 import time
+import heapq
 
 from   math                      import log, ceil
 from   operator                  import itemgetter
-from   collections               import defaultdict
+from   collections               import defaultdict, deque
 from   itertools                 import chain, groupby, izip, dropwhile, count
 
+import numpy as np
+
 from   glu.lib.hwp               import hwp_biallelic
 from   glu.lib.stats             import mean, median
-from   glu.lib.utils             import pair_generator, percent
+from   glu.lib.utils             import pair_generator, percent, pool_imap
 from   glu.lib.fileutils         import autofile, hyphen, list_reader, table_reader, table_writer
 from   glu.lib.glu_launcher      import GLUError
 from   glu.lib.genolib           import load_genostream, geno_options
-from   glu.lib.genolib.ld        import estimate_ld, count_haplotypes, bound_ld
-from   glu.lib.genolib.genoarray import minor_allele_from_genos
+from   glu.lib.genolib.ld        import estimate_ld_batch, bound_ld
+from   glu.lib.genolib.genoarray import count_genotypes, minor_allele_from_genocounts
 
 
 epsilon = 10e-10
@@ -49,24 +51,108 @@ LOCUS_HEADER1   = ['LNAME','LOCATION','MAF','BINNUM','DISPOSITION']
 LOCUS_HEADER2   = ['LNAME','LOCATION','POPULATION','MAF','BINNUM','DISPOSITION']
 LOCUS_HEADER3   = ['LNAME','CHROMOSOME','LOCATION','POPULATION','MAF','BINNUM','DISPOSITION']
 PAIR_HEADER     = ['BIN','LNAME1','LNAME2','POPULATION','RSQUARED','DPRIME','DISPOSITION']
-re_spaces = re.compile('[\t ,]+')
 
 
 class TagZillaError(GLUError): pass
 
 
 class Locus(object):
-  __slots__ = ('name','chromosome','location','maf','genos')
-  def __init__(self, name, chromosome, location, genos):
-    a,maf = minor_allele_from_genos(genos)
+  __slots__ = ('name','chromosome','location','maf','missing','genocounts','genos')
+  def __init__(self, name, chromosome, location, genos, maf=0.0):
+    if genos:
+      counts  = count_genotypes(genos)
+      a,maf   = minor_allele_from_genocounts(genos[0].model,counts)
+      missing = counts[0]
+    else:
+      counts  = None
+      missing = 0
 
     self.name       = name
     self.chromosome = chromosome
     self.location   = location or 0
     self.maf        = maf
+    self.missing    = missing
+    self.genocounts = counts
     self.genos      = genos
 
 
+class LocusTable(object):
+  '''
+  Column-oriented store of the loci attributes needed to scan for pairwise
+  LD.  Names and genotypes are kept in parallel lists and the numeric
+  attributes in arrays, so that the scan works on indices rather than on
+  Locus objects.
+  '''
+  __slots__ = ('names','genos','chromosomes','locations','mafs','called','missing')
+
+  def __init__(self, loci=()):
+    loci = list(loci)
+
+    self.names       = [ locus.name  for locus in loci ]
+    self.genos       = [ locus.genos for locus in loci ]
+    self.chromosomes = np.array([ locus.chromosome        for locus in loci ], dtype=object)
+    self.locations   = np.array([ locus.location          for locus in loci ], dtype=np.int64)
+    self.mafs        = np.array([ locus.maf               for locus in loci ], dtype=float)
+    self.missing     = np.array([ locus.missing           for locus in loci ], dtype=np.int64)
+    self.called      = np.array([ len(genos) for genos in self.genos ], dtype=np.int64) - self.missing
+
+  def __len__(self):
+    return len(self.names)
+
+  def slice(self, start, stop):
+    '''
+    Return a LocusTable of the loci with indices in [start,stop)
+    '''
+    table = LocusTable()
+    for attr in self.__slots__:
+      setattr(table, attr, getattr(self,attr)[start:stop])
+    return table
+
+  def regions(self, maxd):
+    '''
+    Return (start,stop) index ranges of non-communicating regions, split at
+    chromosome boundaries and at gaps larger than maxd.  Loci are assumed
+    to be sorted by genomic location.
+    '''
+    n = len(self)
+    if not n:
+      return []
+
+    breaks = (self.chromosomes[1:]!=self.chromosomes[:-1]) | (np.diff(self.locations)>maxd)
+    breaks = [0] + (np.flatnonzero(breaks)+1).tolist() + [n]
+
+    return zip(breaks[:-1],breaks[1:])
+
+
+def maf_odds_bounds(table):
+  '''
+  Return arrays of lower and upper bounds on the odds of the minor allele
+  frequency of each locus, taken over any subset of its genotyped samples
+  that excludes no more than the largest number of missing genotypes at any
+  of the loci.  These bound the allele frequencies that can be observed
+  when a locus is paired with any other, since only samples genotyped at
+  both loci are counted.
+
+  For minor allele frequencies p<=q, r-squared cannot exceed
+  odds(p)/odds(q), so a pair of loci can reach an r-squared threshold only
+  if hi[i]>=r*lo[j] and hi[j]>=r*lo[i].
+  '''
+  dropped = 2*table.missing.max()
+
+  # Dropping samples removes at most two alleles each, which moves the
+  # minor allele frequency furthest when all or none of them are minor
+  alleles = 2.0*table.called
+  minor   = table.mafs*alleles
+  rest    = alleles-dropped
+  valid   = rest>0
+  rest    = np.where(valid,rest,1)
+
+  lo = np.where(valid, np.maximum(minor-dropped,0)/rest, 0.0)
+  hi = np.where(valid, np.minimum(minor/rest,0.5),       0.5)
+
+  return lo/(1-lo),hi/(1-hi)
+
+
 def scan_ldpairs(loci, maxd, rthreshold, dthreshold):
   '''
   A generator for pairs of loci within a specified genomic distance.
@@ -76,106 +162,54 @@ def scan_ldpairs(loci, maxd, rthreshold, dthreshold):
   or gaps larger than maxd and generates pairwise ld using
   scan_ldpairs_region
   '''
-  regions  = []
-  region   = []
-  last_chr = None
-  last_loc = 0
-
-  # Collect all regions
-  for locus in loci:
-    chr = locus.chromosome
-    loc = locus.location
-
-    # Detect boundary and split the current region
-    if (chr!=last_chr or loc-last_loc>maxd) and region:
-      regions.append(region)
-      region = []
-
-    last_chr = chr
-    last_loc = loc
-    region.append(locus)
-
-  # Pick up tailings
-  if region:
-    regions.append(region)
+  table   = LocusTable(loci)
+  regions = table.regions(maxd)
 
   # Generate ld and chain results together
   sys.stderr.write('[%s] Generating LD in %d region(s)\n' % (time.asctime(),len(regions)))
-  return [ iter(scan_ldpairs_region(region, maxd, rthreshold, dthreshold)) for region in regions ]
+  return [ iter(scan_ldpairs_region(table.slice(start,stop), maxd, rthreshold, dthreshold))
+           for start,stop in regions ]
 
 
-def scan_ldpairs_region(loci, maxd, rthreshold, dthreshold):
+def scan_ldpairs_region(table, maxd, rthreshold, dthreshold):
   '''
   A generator for pairs of loci within a specified genomic distance.
   Loci are assumed to be sorted by genomic location.
   '''
+  names     = table.names
+  genos     = table.genos
+  locations = table.locations
+  stops     = np.searchsorted(locations, locations+maxd, side='right').tolist()
+  lo,hi     = maf_odds_bounds(table)
+  rmin      = rthreshold-epsilon
+
   # Scan each locus
-  n = len(loci)
+  n = len(table)
   for i in xrange(n):
-    locus1    = loci[i]
-    name1     = locus1.name
-    genos1    = locus1.genos
-    location1 = locus1.location
+    name1 = names[i]
 
     yield name1,name1,1.0,1.0
 
     # And up to maxd distance beyond it
-    for j in xrange(i+1,n):
-      locus2    = loci[j]
-      location2 = locus2.location
+    j = stops[i]
 
-      if location2 - location1 > maxd:
-        break
+    # Skip pairs whose allele frequencies are too far apart to reach rthreshold
+    if rmin > 0:
+      others = (np.flatnonzero( (hi[i]>=rmin*lo[i+1:j]) & (hi[i+1:j]>=rmin*lo[i]) )+(i+1)).tolist()
+    else:
+      others = range(i+1,j)
 
-      counts = count_haplotypes(genos1, locus2.genos)
-      r2,dprime = estimate_ld(*counts)
+    ld = estimate_ld_batch(genos[i], [ genos[k] for k in others ])
 
+    for k,(r2,dprime) in izip(others,ld):
       if r2 >= rthreshold and abs(dprime) >= dthreshold:
-        yield name1,locus2.name,r2,dprime
-
-
-def filter_loci_by_maf(loci, minmaf, minobmaf, include):
-  '''
-  Generator that filters loci by a minimum MAF
-
-  Loci come in two flavors, each with a distinct minimum MAF.
-  If the locus.name is not in the provided include set, then
-  the minmaf parameter is used as a threshold.  Otherwise, the
-  minobmaf (minimum obligate MAF) threshold is applied.
-  '''
-
-  mafs = (minmaf,minobmaf)
-  for locus in loci:
-    # For mafs[locus.name in include], the index evaluates to:
-    #    False == 0: Choose mafs[0] == minmaf
-    #    True  == 1: Choose mafs[1] == minobmaf
-    if locus.maf >= mafs[locus.name in include]:
-      yield locus
-
-
-def filter_loci_by_inclusion(loci, include):
-  '''Generator that filters loci based on an inclusion set'''
-
-  for locus in loci:
-    if locus.name in include:
-      yield locus
-
-
-def filter_loci_by_hwp(loci, pvalue):
-  '''
-  Generator that filters loci based on significance of deviation from
-  Hardy-Weinberg proportions
-  '''
-  for locus in loci:
-    p = hwp_biallelic(locus.genos)
-    if p >= pvalue:
-      yield locus
+        yield name1,names[k],r2,dprime
 
 
 range_all = (-sys.maxint,sys.maxint)
 
-def filter_loci_by_range(loci, rangestring):
-  '''Generator that filters loci based on an inclusion range'''
+def parse_ranges(rangestring):
+  '''Parse a comma separated list of genomic ranges into (start,stop) pairs'''
 
   ranges = []
   for range in rangestring.split(','):
@@ -195,29 +229,7 @@ def filter_loci_by_range(loci, rangestring):
   if range_all in ranges:
     ranges = [range_all]
 
-  for locus in loci:
-    for start,stop in ranges:
-      if start <= locus.location < stop:
-        yield locus
-        break
-
-
-def completion(locus):
-  return sum(1 for g in locus if g),len(locus)
-
-
-def filter_loci_by_completion(loci, mincompletion, mincompletionrate):
-  '''Generator that filters loci by a minimum completion rate'''
-
-  for locus in loci:
-    m,n = completion(locus.genos)
-
-    rate = 0
-    if n:
-      rate = float(m)/n
-
-    if m >= mincompletion and rate >= mincompletionrate:
-      yield locus
+  return ranges
 
 
 class Bin(set):
@@ -280,6 +292,19 @@ class BinResult(object):
   __slots__ = ('binnum','tags','others','tags_required','average_maf','include',
                'ld','disposition','maxcovered','recommended_tags','include_typed')
 
+  def __init__(self):
+    self.binnum           = None
+    self.tags             = []
+    self.others           = []
+    self.tags_required    = 1
+    self.average_maf      = 0
+    self.include          = None
+    self.ld               = []
+    self.disposition      = 'maximal-bin'
+    self.maxcovered       = 0
+    self.recommended_tags = []
+    self.include_typed    = None
+
   def sort(self):
     self.ld.sort(cmp=binldcmp)
 
@@ -333,6 +358,30 @@ class BinStat(object):
     new.excludes      = self.excludes      + other.excludes
     return new
 
+  def __iadd__(self, other):
+    self.count         += other.count
+    self.tags_required += other.tags_required
+    self.loci          += other.loci
+    self.width         += other.width
+    self.spacing       += other.spacing
+    self.total_tags    += other.total_tags
+    self.others        += other.others
+    self.includes      += other.includes
+    self.excludes      += other.excludes
+    return self
+
+
+def sum_binstats(stats):
+  '''
+  Return a new BinStat holding the totals of stats, accumulated in place
+  rather than by creating an intermediate BinStat per element as sum()
+  would
+  '''
+  total = BinStat()
+  for stat in stats:
+    total += stat
+  return total
+
 
 class NullPairwiseBinOutput(object):
   def emit_bin(self, bin, qualifier, population, options):
@@ -353,6 +402,7 @@ class PairwiseBinOutput(NullPairwiseBinOutput):
     exclude = self.exclude
     bin.sort()
 
+    rows = []
     for lname1,lname2,r2,dprime in bin.ld:
       if options.skip and (bin.disposition in ('obligate-exclude','residual')
                         or lname1 in exclude or lname2 in exclude):
@@ -361,17 +411,17 @@ class PairwiseBinOutput(NullPairwiseBinOutput):
       r2 = sfloat(r2)
       dprime = sfloat(dprime)
       disposition = pair_disposition(lname1, lname2, bin, qualifier)
-      outfile.writerow([bin.binnum,lname1,lname2,population,r2,dprime,disposition])
+      rows.append([bin.binnum,lname1,lname2,population,r2,dprime,disposition])
+
+    outfile.writerows(rows)
 
   def emit_extra(self, lddata, tags, population):
     outfile = self.outfile
     bin = BinResult()
     bin.tags = set(tags)
-    for (lname1,lname2),(r2,dprime) in lddata.iteritems():
-      disposition = pair_disposition(lname1,lname2,bin,qualifier='interbin')
-      r2     = sfloat(r2)
-      dprime = sfloat(dprime)
-      outfile.writerow(['',lname1,lname2,population,r2,dprime,disposition])
+    outfile.writerows( ['',lname1,lname2,population,sfloat(r2),sfloat(dprime),
+                            pair_disposition(lname1,lname2,bin,qualifier='interbin')]
+                       for lname1,lname2,r2,dprime in lddata.itervalues() )
 
 
 def save_ldpairs(filename, ldpairs):
@@ -400,12 +450,15 @@ class LocusOutput(NullLocusOutput):
   def emit_bin(self, bin, locusmap, qualifier, population):
     locusinfofile = self.locusinfofile
     exclude = self.exclude
+    rows = []
     for lname in chain(bin.tags,bin.others):
       disposition = locus_disposition(lname, bin, exclude, qualifier)
       l = locusmap[lname]
       maf = sfloat(l.maf)
-      locusinfofile.writerow([l.name, l.chromosome, l.location, population,
-                                   maf, bin.binnum, disposition])
+      rows.append([l.name, l.chromosome, l.location, population,
+                        maf, bin.binnum, disposition])
+
+    locusinfofile.writerows(rows)
 
 
 class NullBinInfo(object):
@@ -462,88 +515,103 @@ class BinInfo(NullBinInfo):
       return
 
     population = population or 'default'
-    out.write('Bin %-4d population: %s, sites: %d, tags %d, other %d, tags required %d, width %d, avg. MAF %.1f%%\n' \
+
+    # Format the whole bin before writing it out at once
+    lines = []
+    write = lines.append
+
+    write('Bin %-4d population: %s, sites: %d, tags %d, other %d, tags required %d, width %d, avg. MAF %.1f%%\n' \
                    % (binnum,population,binsize,len(bin.tags),len(bin.others),bin.tags_required,width,amaf))
-    out.write('Bin %-4d Location: min %d, median %d, mean %d, max %d\n' \
-                  % (binnum,locs[0],median(locs),mean(locs),locs[-1]))
+    write('Bin %-4d Location: min %d, median %d, mean %d, max %d\n' \
+                  % (binnum,locs[0],median(locs,presorted=True),mean(locs),locs[-1]))
     if len(spacing) > 1:
-      out.write('Bin %-4d Spacing: min %d, median %d, mean %d, max %d\n' \
-                    % (binnum,spacing[0],median(spacing),mean(spacing),spacing[-1]))
-    out.write('Bin %-4d TagSnps: %s\n' % (binnum,' '.join(sorted(bin.tags))))
+      write('Bin %-4d Spacing: min %d, median %d, mean %d, max %d\n' \
+                    % (binnum,spacing[0],median(spacing,presorted=True),mean(spacing),spacing[-1]))
+    write('Bin %-4d TagSnps: %s\n' % (binnum,' '.join(sorted(bin.tags))))
     if bin.recommended_tags:
-      out.write('Bin %-4d RecommendedTags: %s\n' % (binnum, ' '.join(bin.recommended_tags)))
-    out.write('Bin %-4d other_snps: %s\n' % (binnum,' '.join(sorted(bin.others))))
+      write('Bin %-4d RecommendedTags: %s\n' % (binnum, ' '.join(bin.recommended_tags)))
+    write('Bin %-4d other_snps: %s\n' % (binnum,' '.join(sorted(bin.others))))
 
     if bin.include is not None:
       if bin.disposition == 'obligate-untyped':
-        out.write('Bin %-4d Obligate_tag: %s, untyped\n' % (binnum,bin.include))
+        write('Bin %-4d Obligate_tag: %s, untyped\n' % (binnum,bin.include))
       else:
-        out.write('Bin %-4d Obligate_tag: %s, typed\n' % (binnum,bin.include))
+        write('Bin %-4d Obligate_tag: %s, typed\n' % (binnum,bin.include))
 
     if excls:
-      out.write('Bin %-4d Excluded_as_tags: %s\n' % (binnum,' '.join(sorted(excls))))
+      write('Bin %-4d Excluded_as_tags: %s\n' % (binnum,' '.join(sorted(excls))))
+
+    write('Bin %-4d Bin_disposition: %s\n' % (binnum,bin.disposition))
+    write('Bin %-4d Loci_covered: %s\n' % (binnum,bin.maxcovered))
+    write('\n')
 
-    out.write('Bin %-4d Bin_disposition: %s\n' % (binnum,bin.disposition))
-    out.write('Bin %-4d Loci_covered: %s\n' % (binnum,bin.maxcovered))
-    out.write('\n')
+    out.write(''.join(lines))
 
 
   def emit_summary(self, sumfile, population):
-    out = sumfile
+    lines = []
+    write = lines.append
     stats = self.stats.get(population,{})
 
     tstats = {}
     for d in self.dispositions:
       if d in stats:
-        self.emit_summary_stats(out, stats[d], d, population)
-        tstats[d] = sum(stats[d], BinStat())
+        self.emit_summary_stats(write, stats[d], d, population)
+        tstats[d] = sum_binstats(stats[d])
 
     if not population:
-      out.write('\nBin statistics by disposition:\n')
+      write('\nBin statistics by disposition:\n')
     else:
-      out.write('\nBin statistics by disposition for population %s:\n' % population)
+      write('\nBin statistics by disposition for population %s:\n' % population)
 
-    out.write('                      tags                                total   non-     avg    avg\n')
-    out.write(' disposition          req.   bins     %    loci      %    tags    tags    tags  width\n')
-    out.write(' -------------------- ------ ------ ------ ------- ------ ------- ------- ---- ------\n')
+    write('                      tags                                total   non-     avg    avg\n')
+    write(' disposition          req.   bins     %    loci      %    tags    tags    tags  width\n')
+    write(' -------------------- ------ ------ ------ ------- ------ ------- ------- ---- ------\n')
 
     total_bins = sum(s.count for s in tstats.values())
     total_loci = sum(s.loci  for s in tstats.values())
 
     for d in self.dispositions:
-      self.emit_summary_line(out, '%-20s' % d, tstats.get(d,BinStat()), total_bins, total_loci)
+      self.emit_summary_line(write, '%-20s' % d, tstats.get(d,BinStat()), total_bins, total_loci)
 
-    self.emit_summary_line(out, '              Total ', sum(tstats.values(), BinStat()), total_bins, total_loci)
-    out.write('\n')
-    out.flush()
+    self.emit_summary_line(write, '              Total ', sum_binstats(tstats.itervalues()), total_bins, total_loci)
+    write('\n')
+
+    sumfile.write(''.join(lines))
+    sumfile.flush()
 
 
   def emit_multipop_summary(self, sumfile, tags):
     n = sum(tags.itervalues())
 
-    sumfile.write('\nTags required by disposition for all populations:\n')
+    lines = []
+    write = lines.append
+
+    write('\nTags required by disposition for all populations:\n')
 
-    sumfile.write('                      tags         \n')
-    sumfile.write(' disposition          req.     %   \n')
-    sumfile.write(' -------------------- ------ ------\n')
+    write('                      tags         \n')
+    write(' disposition          req.     %   \n')
+    write(' -------------------- ------ ------\n')
 
     for d in self.dispositions:
       m = tags.get(d,0)
-      sumfile.write(' %-20s %6d %6.2f\n' % (d,m,percent(m,n)))
+      write(' %-20s %6d %6.2f\n' % (d,m,percent(m,n)))
 
-    sumfile.write('              Total   %6d %6.2f\n\n' % (n, 100))
+    write('              Total   %6d %6.2f\n\n' % (n, 100))
+
+    sumfile.write(''.join(lines))
     sumfile.flush()
 
 
-  def emit_summary_stats(self, out, stats, disposition, population):
+  def emit_summary_stats(self, write, stats, disposition, population):
     if not population:
-      out.write('\nBin statistics by bin size for %s:\n\n' % disposition)
+      write('\nBin statistics by bin size for %s:\n\n' % disposition)
     else:
-      out.write('\nBin statistics by bin size for %s for population %s:\n\n' % (disposition,population))
+      write('\nBin statistics by bin size for %s for population %s:\n\n' % (disposition,population))
 
-    out.write(' bin   tags                                total   non-     avg    avg\n')
-    out.write(' size  req.   bins     %    loci      %    tags    tags    tags  width\n')
-    out.write(' ----- ------ ------ ------ ------- ------ ------- ------- ---- ------\n')
+    write(' bin   tags                                total   non-     avg    avg\n')
+    write(' size  req.   bins     %    loci      %    tags    tags    tags  width\n')
+    write(' ----- ------ ------ ------ ------- ------ ------- ------- ---- ------\n')
     total_bins = sum(s.count for s in stats)
     total_loci = sum(s.loci  for s in stats)
 
@@ -559,13 +627,13 @@ class BinInfo(NullBinInfo):
       else:
         label = '%3d  ' % i
 
-      self.emit_summary_line(out, label, stats[i], total_bins, total_loci)
+      self.emit_summary_line(write, label, stats[i], total_bins, total_loci)
 
-    self.emit_summary_line(out, 'Total', sum(stats, BinStat()), total_bins, total_loci)
-    out.write('\n')
+    self.emit_summary_line(write, 'Total', sum_binstats(stats), total_bins, total_loci)
+    write('\n')
 
 
-  def emit_summary_line(self, out, label, stats, total_bins, total_loci):
+  def emit_summary_line(self, write, label, stats, total_bins, total_loci):
     n = stats.count
     m = stats.loci
     if n:
@@ -573,11 +641,88 @@ class BinInfo(NullBinInfo):
       w = float(stats.width) / n
     else:
       t,w = 0,0
-    out.write(' %s %6d %6d %6.2f %7d %6.2f %7d %7d %4.1f %6d\n' % (label,
+    write(' %s %6d %6d %6.2f %7d %6.2f %7d %7d %4.1f %6d\n' % (label,
               stats.tags_required,n,percent(n,total_bins),
               m,percent(m,total_loci),stats.total_tags,stats.others,t,w))
 
 
+def _take_other(bin, lname, exclude):
+  bin.others.append(lname)
+
+
+def _take_exclude(bin, lname, exclude):
+  bin.others.append(lname)
+  exclude.add(lname)
+
+
+def _take_tag(bin, lname, exclude):
+  bin.tags.append(lname)
+
+
+def _take_excluded_tag(bin, lname, exclude):
+  bin.tags.append(lname)
+  bin.disposition = 'obligate-exclude'
+
+
+def _take_obligate_tag(bin, lname, exclude):
+  bin.tags.append(lname)
+  bin.disposition = 'obligate-include'
+  bin.include = lname
+
+
+def _take_untyped_tag(bin, lname, exclude):
+  bin.tags.append(lname)
+  bin.disposition = 'obligate-untyped'
+  bin.include = lname
+
+
+def _take_typed_tag(bin, lname, exclude):
+  bin.tags.append(lname)
+  bin.disposition = 'obligate-typed'
+  bin.include = lname
+
+
+def _take_lonely_tag(bin, lname, exclude):
+  bin.tags.append(lname)
+  bin.maxcovered = 2
+
+
+# Locus dispositions in order of precedence and the action taken when
+# replaying each into a BinResult.  Only the first matching entry applies.
+_DISPOSITION_ACTIONS = (('other',         _take_other),
+                        ('exclude',       _take_exclude),
+                        ('excluded-tag',  _take_excluded_tag),
+                        ('obligate-tag',  _take_obligate_tag),
+                        ('untyped-tag',   _take_untyped_tag),
+                        ('typed-tag',     _take_typed_tag),
+                        ('alternate-tag', _take_tag),
+                        ('candidate-tag', _take_tag),
+                        ('necessary-tag', _take_tag),
+                        ('lonely-tag',    _take_lonely_tag),
+                        ('singleton-tag', _take_tag))
+
+
+# Parsers from each tagzilla result file format to locus rows of the form
+# (lname,chromosome,location,population,maf,binnum,disposition), as in
+# LOCUS_HEADER3.  Pair rows between distinct loci are skipped and pair
+# files do not supply bin numbers, leaving bins numbered in file order.
+def _parse_pair_row(row):
+  binnum,lname1,lname2,population,r2,dprime,disposition = row
+  if lname1 != lname2:
+    return None
+  return lname1,'',0,population,0.5,None,disposition
+
+
+def _parse_locus_row1(row):
+  lname,location,maf,binnum,disposition = row
+  return lname,'',location,'',maf,binnum,disposition
+
+
+def _parse_locus_row2(row):
+  lname,location,population,maf,binnum,disposition = row
+  return lname,'',location,population,maf,binnum,disposition
+
+
 def locus_result_sequence(filename, locusmap, exclude):
   '''
   Returns a generator of BinResult objects for the tagzilla locus output
@@ -595,17 +740,17 @@ def locus_result_sequence(filename, locusmap, exclude):
   header = locusfile.next()
 
   if header == PAIR_HEADER:
-    version = 0
-    grouper = itemgetter(0,3)
+    grouper   = itemgetter(0,3)
+    parse_row = _parse_pair_row
   elif header == LOCUS_HEADER1:
-    version = 1
-    grouper = itemgetter(3)
+    grouper   = itemgetter(3)
+    parse_row = _parse_locus_row1
   elif header == LOCUS_HEADER2:
-    version = 2
-    grouper = itemgetter(4,2)
+    grouper   = itemgetter(4,2)
+    parse_row = _parse_locus_row2
   elif header == LOCUS_HEADER3:
-    version = 3
-    grouper = itemgetter(5,3)
+    grouper   = itemgetter(5,3)
+    parse_row = tuple
   else:
     raise TagZillaError('ERROR: Invalid input format for file %s.' % filename)
 
@@ -613,74 +758,28 @@ def locus_result_sequence(filename, locusmap, exclude):
   for binnum,(_,loci) in enumerate(groupby(locusfile,grouper)):
     bin = BinResult()
     bin.binnum = binnum
-
-    bin.tags = []
-    bin.others = []
-    bin.ld = []
-    bin.include = None
-    bin.average_maf = 0
-    bin.maxcovered = 0
-    bin.recommended_tags = []
-    bin.disposition = 'maximal-bin'
-    bin.tags_required = 1
+    maf_sum = 0.
 
     for locus in loci:
-      if version == 0:
-        if locus[1] != locus[2]:
-          continue
-        lname = locus[1]
-        location = 0
-        population = locus[3]
-        maf = 0.5
-        disposition = locus[6]
-      elif version == 1:
-        lname,location,maf,binnum,disposition = locus
-        population = chr = ''
-      elif version == 2:
-        lname,location,population,maf,binnum,disposition = locus
-        chr = ''
-      elif version == 3:
-        lname,chr,location,population,maf,binnum,disposition = locus
+      locus = parse_row(locus)
+      if locus is None:
+        continue
 
-      bin.binnum = binnum
-      locus = locusmap[lname] = Locus(lname, chr, int(location), [])
+      lname,chr,location,population,maf,binnum,disposition = locus
+      lname = intern(lname)
 
+      if binnum is not None:
+        bin.binnum = int(binnum)
       maf = float(maf)
-      locus.maf = maf
-      bin.average_maf += maf
+      locusmap[lname] = Locus(lname, chr, int(location), [], maf)
+      maf_sum += maf
 
-      disposition = disposition.split(',')
+      disposition = frozenset(disposition.split(','))
 
-      if 'other' in disposition:
-        bin.others.append(lname)
-      elif 'exclude' in disposition:
-        bin.others.append(lname)
-        exclude.add(lname)
-      elif 'excluded-tag' in disposition:
-        bin.tags.append(lname)
-        bin.disposition = 'obligate-exclude'
-      elif 'obligate-tag' in disposition:
-        bin.tags.append(lname)
-        bin.disposition = 'obligate-include'
-        bin.include = lname
-      elif 'untyped-tag' in disposition:
-        bin.tags.append(lname)
-        bin.disposition = 'obligate-untyped'
-        bin.include = lname
-      elif 'typed-tag' in disposition:
-        bin.tags.append(lname)
-        bin.disposition = 'obligate-typed'
-        bin.include = lname
-      elif 'alternate-tag' in disposition:
-        bin.tags.append(lname)
-      elif 'candidate-tag' in disposition or \
-           'necessary-tag' in disposition:
-        bin.tags.append(lname)
-      elif 'lonely-tag' in disposition:
-        bin.tags.append(lname)
-        bin.maxcovered = 2
-      elif 'singleton-tag' in disposition:
-        bin.tags.append(lname)
+      for tag,action in _DISPOSITION_ACTIONS:
+        if tag in disposition:
+          action(bin, lname, exclude)
+          break
 
       if 'recommended' in disposition:
         bin.recommended_tags.append(lname)
@@ -694,8 +793,11 @@ def locus_result_sequence(filename, locusmap, exclude):
       if 'residual' in disposition:
         bin.disposition = 'residual'
 
-    bin.maxcovered = max(bin.maxcovered,len(bin))
-    bin.average_maf /= len(bin)
+    # Loci with unrecognized dispositions count towards the MAF sum but
+    # are not members of the bin
+    n = len(bin)
+    bin.maxcovered  = max(bin.maxcovered,n)
+    bin.average_maf = maf_sum/n
 
     yield population,bin
 
@@ -781,24 +883,13 @@ class NaiveBinSequence(object):
       self.binsets[other_locus].discard(taken_locus, maf)
 
   def split_bin(self, ref_lname, bin):
-    ld = []
-    for lname in bin:
-      if lname == ref_lname:
-        continue
-
-      covered = len(self.binsets.get(lname,[]))
-
-      lname1,lname2 = ref_lname,lname
-      if (lname1,lname2) not in self.lddata:
-        lname1,lname2=lname2,lname1
-
-      r2,dprime = self.lddata[lname1,lname2]
-      ld.append( (-covered,r2,lname) )
-
-    ld.sort()
+    get_bin = self.binsets.get
+    lddata  = self.lddata
 
     # Remove smallest ld value
-    covered,r2,lname = ld[0]
+    covered,r2,lname = min( (-len(get_bin(lname,())),
+                             lddata[(ref_lname,lname) if ref_lname < lname else (lname,ref_lname)][2],
+                             lname) for lname in bin if lname != ref_lname )
     self.reduce_bin(ref_lname, lname, self.loci[lname].maf)
     self.reduce_bin(lname, ref_lname, self.loci[ref_lname].maf)
 
@@ -822,9 +913,64 @@ class FastBinSequence(NaiveBinSequence):
     return NaiveBinSequence.pop_bin(self, lname)
 
   def reduce_bin(self, other_locus, taken_locus, maf):
-    NaiveBinSequence.reduce_bin(self, other_locus, taken_locus, maf)
-    if other_locus in self.binsets:
-      self.pq[other_locus] = self.binsets[other_locus].priority()
+    # Only requeue bins whose priority actually changed
+    bin = self.binsets.get(other_locus)
+    if bin is not None and taken_locus in bin:
+      bin.remove(taken_locus, maf)
+      self.pq[other_locus] = bin.priority()
+
+
+class _BinHeap(object):
+  '''
+  Priority queue of locus names built on heapq, used when the pqueue
+  extension is not available.  Updated and removed entries are left in the
+  heap and skipped lazily by peek.
+
+  >>> pq = _BinHeap()
+  >>> pq['l1'] = (0,-2)
+  >>> pq['l2'] = (0,-3)
+  >>> pq['l3'] = (0,-1)
+  >>> pq.peek()
+  ((0, -3), 'l2')
+  >>> pq['l2'] = (0,0)
+  >>> pq.peek()
+  ((0, -2), 'l1')
+  >>> del pq['l1']
+  >>> pq.peek()
+  ((0, -1), 'l3')
+  '''
+  def __init__(self):
+    self.heap    = []
+    self.entries = {}
+    self.counter = count()
+
+  def __setitem__(self, lname, priority):
+    entry = (priority,self.counter.next(),lname)
+    self.entries[lname] = entry
+    heapq.heappush(self.heap, entry)
+
+  def __delitem__(self, lname):
+    del self.entries[lname]
+
+  def peek(self):
+    heap    = self.heap
+    entries = self.entries
+
+    while entries.get(heap[0][2]) is not heap[0]:
+      heapq.heappop(heap)
+
+    priority,counter,lname = heap[0]
+    return priority,lname
+
+
+class _HeapBinSequence(FastBinSequence):
+  def __init__(self, loci, binsets, lddata, get_tags_required):
+    NaiveBinSequence.__init__(self, loci, binsets, lddata, get_tags_required)
+
+    self.pq = pq = _BinHeap()
+
+    for lname,bin in binsets.iteritems():
+      pq[lname] = bin.priority()
 
 
 def BinSequence(loci, binsets, lddata, get_tags_required):
@@ -833,7 +979,7 @@ def BinSequence(loci, binsets, lddata, get_tags_required):
   except ImportError:
     pass
 
-  return NaiveBinSequence(loci, binsets, lddata, get_tags_required)
+  return _HeapBinSequence(loci, binsets, lddata, get_tags_required)
 
 
 class NaiveMultiBinSequence(object):
@@ -858,10 +1004,10 @@ class NaiveMultiBinSequence(object):
       ref_lname = self.peek()
 
       split = False
-      for pop_binsets,pop_loci in izip(self.binsets,self.loci):
+      for pop_binsets,pop_loci,pop_lddata in izip(self.binsets,self.loci,self.lddata):
         bin = pop_binsets.get(ref_lname,None)
         if bin and must_split_bin(bin, pop_binsets, self.get_tags_required):
-          self.split_bin(pop_binsets, pop_loci, ref_lname,bin)
+          self.split_bin(pop_binsets, pop_loci, pop_lddata, ref_lname, bin)
           split = True
           break
 
@@ -894,20 +1040,11 @@ class NaiveMultiBinSequence(object):
   next = pop
 
   def peek(self):
-    lnames = iter(self.lnames)
-
-    prio = None
-    while prio is None:
-      lname = lnames.next()
-      prio  = self.priority(lname)
-
-    # Then iterate through the remaining items to refine the result
-    for current_lname in lnames:
-      current_prio = self.priority(current_lname)
-      if current_prio is not None and current_prio < prio:
-        lname = current_lname
-        prio  = current_prio
-
+    # Take the first locus with the smallest priority, ignoring those that
+    # are no longer in any population's bins
+    priority = self.priority
+    bins     = ( (priority(lname),lname) for lname in self.lnames )
+    prio,lname = min( (bin for bin in bins if bin[0] is not None), key=itemgetter(0) )
     return lname
 
   def reduce_bin(self, binsets, other_locus, taken_locus, maf):
@@ -937,25 +1074,13 @@ class NaiveMultiBinSequence(object):
     else:
       return None
 
-  def split_bin(self, binsets, loci, ref_lname, bin):
-    ld = []
-    for lname in bin:
-      if lname == ref_lname:
-        continue
-
-      covered = len(binsets.get(lname,[]))
-
-      lname1,lname2 = ref_lname,lname
-      if (lname1,lname2) not in self.lddata:
-        lname1,lname2=lname2,lname1
-
-      r2,dprime = self.lddata[lname1,lname2]
-      ld.append( (-covered,r2,lname) )
-
-    ld.sort()
+  def split_bin(self, binsets, loci, lddata, ref_lname, bin):
+    get_bin = binsets.get
 
     # Remove smallest ld value
-    covered,r2,lname = ld[0]
+    covered,r2,lname = min( (-len(get_bin(lname,())),
+                             lddata[(ref_lname,lname) if ref_lname < lname else (lname,ref_lname)][2],
+                             lname) for lname in bin if lname != ref_lname )
     self.reduce_bin(binsets, ref_lname, lname, loci[lname].maf)
     self.reduce_bin(binsets, lname, ref_lname, loci[ref_lname].maf)
     self.update_bins([ref_lname,lname])
@@ -987,13 +1112,23 @@ class FastMultiBinSequence(NaiveMultiBinSequence):
         del self.pq[lname]
 
 
+class _HeapMultiBinSequence(FastMultiBinSequence):
+  def __init__(self, loci, binsets, lddata, get_tags_required):
+    NaiveMultiBinSequence.__init__(self, loci, binsets, lddata, get_tags_required)
+
+    self.pq = pq = _BinHeap()
+
+    for lname in self.lnames:
+      pq[lname] = self.priority(lname)
+
+
 def MultiBinSequence(loci, binsets, lddata, get_tags_required):
   try:
     return FastMultiBinSequence(loci, binsets, lddata, get_tags_required)
   except ImportError:
     pass
 
-  return NaiveMultiBinSequence(loci, binsets, lddata, get_tags_required)
+  return _HeapMultiBinSequence(loci, binsets, lddata, get_tags_required)
 
 
 def build_binsets(loci, ldpairs, includes, exclude, designscores):
@@ -1001,23 +1136,35 @@ def build_binsets(loci, ldpairs, includes, exclude, designscores):
   Build initial data structures:
     binsets: Dictionary that for each locus, stores the set of all other
              loci that meet the rthreshold and the sum of the MAFs
-    lddata:  Dictionary of locus pairs to r-squared values
+    lddata:  Dictionary of locus pairs, keyed in sorted order of locus
+             name, to the (lname1,lname2,r2,dprime) tuple as scanned
   '''
 
   binsets = {}
   lddata  = {}
 
+  # Bind the lookups used for every pair to locals
+  get_bin = binsets.get
+
   for pairs in ldpairs:
     for lname1,lname2,r2,dprime in pairs:
-      if lname1 not in binsets:
-        binsets[lname1] = Bin([lname1], loci[lname1].maf)
-      if lname2 not in binsets:
-        binsets[lname2] = Bin([lname2], loci[lname2].maf)
+      maf1 = loci[lname1].maf
+      bin1 = get_bin(lname1)
+      if bin1 is None:
+        bin1 = binsets[lname1] = Bin([lname1], maf1)
+
+      if lname1 == lname2:
+        continue
+
+      maf2 = loci[lname2].maf
+      bin2 = get_bin(lname2)
+      if bin2 is None:
+        bin2 = binsets[lname2] = Bin([lname2], maf2)
 
-      if lname1 != lname2:
-        binsets[lname1].add(lname2, loci[lname2].maf)
-        lddata[lname1,lname2] = r2,dprime
-        binsets[lname2].add(lname1, loci[lname1].maf)
+      bin1.add(lname2, maf2)
+      key = (lname1,lname2) if lname1 < lname2 else (lname2,lname1)
+      lddata[key] = lname1,lname2,r2,dprime
+      bin2.add(lname1, maf1)
 
   # Update the bin disposition if the lname is one of the excludes
   for lname in exclude or []:
@@ -1050,20 +1197,20 @@ def build_binsets(loci, ldpairs, includes, exclude, designscores):
   return binsets,lddata
 
 
+# Qualifiers of bins within the target bins or loci, by bin disposition
+_BIN_QUALIFIERS = {'obligate-exclude' : 'excluded',
+                   'obligate-typed'   : 'typed_bin',
+                   'obligate-untyped' : 'untyped_bin'}
+
+
 def bin_qualifier(bin, binned_loci, options):
-  qualifier = ''
-  if ((options.targetbins and  bin.binnum > options.targetbins) or \
-      (options.targetloci and binned_loci > options.targetloci)) and \
-      bin.disposition != 'obligate-exclude':
-    qualifier = 'residual'
+  disposition = bin.disposition
+  if disposition != 'obligate-exclude' and \
+     ((options.targetbins and bin.binnum  > options.targetbins) or \
+      (options.targetloci and binned_loci > options.targetloci)):
     bin.disposition = 'residual'
-  elif bin.disposition == 'obligate-exclude':
-    qualifier = 'excluded'
-  elif bin.disposition == 'obligate-typed':
-    qualifier = 'typed_bin'
-  elif bin.disposition == 'obligate-untyped':
-    qualifier = 'untyped_bin'
-  return qualifier
+    return 'residual'
+  return _BIN_QUALIFIERS.get(disposition,'')
 
 
 def tag_disposition(lname, bin):
@@ -1148,22 +1295,16 @@ def build_result(lname, largest, bins, lddata, includes, get_tags_required):
 
   if get_tags_required:
     result.tags_required = get_tags_required(len(largest))
-  else:
-    result.tags_required = 1
 
-  result.recommended_tags = []
   result.include_typed    = includes.typed & largest
   result.average_maf      = largest.average_maf()
   result.maxcovered       = largest.maxcovered
 
   if largest.disposition in (Bin.INCLUDE_TYPED,Bin.INCLUDE_UNTYPED):
     result.include = lname
-  else:
-    result.include = None
 
-  result.tags   = []
-  result.others = []
-  result.ld     = []
+  tags   = result.tags
+  others = result.others
 
   if largest.disposition == Bin.INCLUDE_UNTYPED:
     result.disposition = 'obligate-untyped'
@@ -1171,38 +1312,40 @@ def build_result(lname, largest, bins, lddata, includes, get_tags_required):
     result.disposition = 'obligate-typed'
   elif largest.disposition == Bin.EXCLUDE:
     result.disposition = 'obligate-exclude'
-  else:
-    result.disposition = 'maximal-bin'
+
+  # Candidate tags may be excluded loci only if the reference bin is.  Tags
+  # of obligate include bins do not update the maximum coverage.
+  EXCLUDE    = Bin.EXCLUDE
+  any_tag    = largest.disposition == EXCLUDE
+  maxcovered = result.maxcovered
+  update_max = result.include is None
 
   # Process each locus in the bin
   for lname,bin in bins.iteritems():
     # If the current bin is a superset of the reference set, then consider this locus
     # a tag.  The superset is needed to handle the case where the reference locus is
-    # an obligate include and may not be the largest bin.
-    if can_tag(bin, largest):
-      result.tags.append(lname)
-
-      # Update maximum coverage number for all candidate tags, except for
-      # obligate include bins
-      if largest.disposition not in (Bin.INCLUDE_TYPED,Bin.INCLUDE_UNTYPED):
-        result.maxcovered = max(result.maxcovered,bin.maxcovered)
+    # an obligate include and may not be the largest bin.  See can_tag.
+    if (any_tag or bin.disposition != EXCLUDE) and bin.issuperset(largest):
+      tags.append(lname)
+      if update_max and bin.maxcovered > maxcovered:
+        maxcovered = bin.maxcovered
     else:
-      result.others.append(lname)
+      others.append(lname)
+
+  result.maxcovered = maxcovered
 
-  assert len(result.tags) >= result.tags_required
+  assert len(tags) >= result.tags_required
 
-  for lname in result.tags:
-    # Output the tags as self-pairs (r-squared=1,dprime=1)
-    result.ld.append( (lname,lname,1.,1.) )
+  # Output the tags as self-pairs (r-squared=1,dprime=1)
+  result.ld = [ (lname,lname,1.,1.) for lname in tags ]
 
   # For each pair of loci in the bin, yield name, location, and LD info
+  pop_pair  = lddata.pop
+  append_ld = result.ld.append
   for lname1,lname2 in pair_generator(largest):
-    if (lname1,lname2) not in lddata:
-      lname1,lname2=lname2,lname1
-
-    if (lname1,lname2) in lddata:
-      r2,dprime = lddata.pop( (lname1,lname2) )
-      result.ld.append( (lname1,lname2,r2,dprime) )
+    pair = pop_pair((lname1,lname2) if lname1 < lname2 else (lname2,lname1),None)
+    if pair is not None:
+      append_ld(pair)
 
   return result
 
@@ -1327,14 +1470,25 @@ def generate_ldpairs_vector(options, include, subset, ldsubset):
   if len(options.genotypes) % pops != 0:
     raise TagZillaError('ERROR: The number of input files must be a multiple of the number of populations')
 
+  processes = min(options.processes, len(options.genotypes))
+
+  if processes > 1:
+    state = (include,subset,ldsubset,options)
+    files = pool_imap(ldpairs_from_file_packed, options.genotypes, processes, state)
+  else:
+    files = None
+
   for i in xrange(regions):
     ldpairs = []
     multi_options = []
     locusmap = []
 
     for filename in options.genotypes[i*pops:(i+1)*pops]:
-      lmap    = {}
-      regions = generate_ldpairs_from_file(filename, lmap, include, subset, ldsubset, options)
+      if files is not None:
+        lmap,regions = files.next()
+      else:
+        lmap    = {}
+        regions = generate_ldpairs_from_file(filename, lmap, include, subset, ldsubset, options)
       pairs   = chain(*regions)
 
       ldpairs.append(pairs)
@@ -1346,6 +1500,7 @@ def generate_ldpairs_vector(options, include, subset, ldsubset):
 def do_tagging_vector(ldpairs, includes, exclude, designscores, options):
   labels = get_populations(options.multipopulation)
   pops = len(labels)
+  get_tags_required = get_tags_required_function(options)
 
   # If we require a total ordering, then build binsets from all ldpairs
   if options.targetbins or options.targetloci:
@@ -1366,7 +1521,7 @@ def do_tagging_vector(ldpairs, includes, exclude, designscores, options):
       lddata.append(pop_lddata)
 
     sys.stderr.write('[%s] Choosing global bins\n' % time.asctime())
-    bins = binner_vector(multi_locusmap, binsets, lddata, includes, get_tags_required_function(options))
+    bins = binner_vector(multi_locusmap, binsets, lddata, includes, get_tags_required)
     yield bins,lddata,multi_locusmap
 
   else:
@@ -1382,29 +1537,34 @@ def do_tagging_vector(ldpairs, includes, exclude, designscores, options):
         lddata.append(pop_lddata)
 
       sys.stderr.write('[%s] Choosing bins\n' % time.asctime())
-      bins = binner_vector(locusmap, binsets, lddata, includes, get_tags_required_function(options))
+      bins = binner_vector(locusmap, binsets, lddata, includes, get_tags_required)
       yield bins,lddata,locusmap
 
 
 def load_festa_file(filename, locusmap, subset, rthreshold):
   '''
   Load FESTA formatted file that contain pre-computed LD data for pairs of loci
+
+  Locus names are interned, so that the many pairs naming each locus share
+  a single string in the binsets and lddata keys built from them.
   '''
   ldfile = autofile(filename)
   header = ldfile.readline()
 
   for line in ldfile:
-    lname1,lname2,ldvalue = re_spaces.split(line.strip())
+    lname1,lname2,ldvalue = line.replace(',',' ').split()
+    lname1  = intern(lname1)
+    lname2  = intern(lname2)
     ldvalue = float(ldvalue)
 
     if subset is not None and (lname1 not in subset or lname2 not in subset):
       continue
 
     if lname1 not in locusmap:
-      locusmap[lname1] = Locus(lname1, 0, [])
+      locusmap[lname1] = Locus(lname1, None, 0, [])
 
     if lname2 not in locusmap:
-      locusmap[lname2] = Locus(lname2, 0, [])
+      locusmap[lname2] = Locus(lname2, None, 0, [])
 
     if ldvalue >= rthreshold:
       yield lname1,lname2,ldvalue,0
@@ -1418,7 +1578,9 @@ def load_hapmapld_file(filename, locusmap, subset, maxd, rthreshold, dthreshold)
   ldfile = dropwhile(lambda s: s.startswith('#'), ldfile)
 
   for line in ldfile:
-    loc1,loc2,pop,lname1,lname2,dprime,r2,lod = line.strip().split(' ')
+    loc1,loc2,pop,lname1,lname2,dprime,r2,lod = line.split()
+    lname1 = intern(lname1)
+    lname2 = intern(lname2)
 
     if subset is not None and (lname1 not in subset or lname2 not in subset):
       continue
@@ -1427,10 +1589,10 @@ def load_hapmapld_file(filename, locusmap, subset, maxd, rthreshold, dthreshold)
     loc2 = int(loc2)
 
     if lname1 not in locusmap:
-      locusmap[lname1] = Locus(lname1, loc1, [])
+      locusmap[lname1] = Locus(lname1, None, loc1, [])
 
     if lname2 not in locusmap:
-      locusmap[lname2] = Locus(lname2, loc2, [])
+      locusmap[lname2] = Locus(lname2, None, loc2, [])
 
     if abs(loc1-loc2) > maxd:
       continue
@@ -1442,6 +1604,37 @@ def load_hapmapld_file(filename, locusmap, subset, maxd, rthreshold, dthreshold)
       yield lname1,lname2,r2,dprime
 
 
+def load_ldpairs_file(filename, locusmap, subset, rthreshold, dthreshold):
+  '''
+  Load pairwise LD data previously saved with -u/--saveldpairs, so that
+  loci may be binned again under stricter thresholds without re-estimating
+  LD.  Locations and MAFs are not saved, so ties between bins of equal size
+  are no longer broken by MAF.
+  '''
+  rows   = table_reader(filename)
+  header = rows.next()
+
+  for row in rows:
+    lname1,lname2,r2,dprime = row[:4]
+    lname1 = intern(lname1)
+    lname2 = intern(lname2)
+
+    if subset is not None and (lname1 not in subset or lname2 not in subset):
+      continue
+
+    if lname1 not in locusmap:
+      locusmap[lname1] = Locus(lname1, None, 0, [])
+
+    if lname2 not in locusmap:
+      locusmap[lname2] = Locus(lname2, None, 0, [])
+
+    r2     = float(r2)
+    dprime = float(dprime)
+
+    if r2 >= rthreshold and abs(dprime) >= dthreshold:
+      yield lname1,lname2,r2,dprime
+
+
 def build_design_score(designscores,designdefault=0):
   designscores = designscores or []
   aggscores = defaultdict(lambda: designdefault)
@@ -1528,30 +1721,28 @@ class TagSelector(object):
     if not method:
       return {}
 
-    # Lexically-scoped weighting functions
-    def maxsnp():
-      w[lname1] = min(w.get(lname1,1),r2)
-    def avgsnp():
-      w[lname1] = w.get(lname1,0) + r2
-    def maxtag():
-      if lname2 not in bin.tags:
-        maxsnp()
-    def avgtag():
-      if lname2 not in bin.tags:
-        avgsnp()
-
-    func = locals().get(method.lower(),None)
-
-    if not callable(func):
+    method = method.lower()
+
+    if method not in ('maxsnp','avgsnp','maxtag','avgtag'):
       raise RuntimeError('Invalid tag information criterion specified')
 
+    # Weight each tag by the LD it shares with the other loci in the bin,
+    # counting only other tags for the *tag criteria
+    tags    = set(bin.tags)
+    maximal = method.startswith('max')
+    tagonly = method.endswith('tag')
+
     w = {}
     for lname1,lname2,r2,dprime in bin.ld:
       if lname1==lname2:
         continue
-      for lname1,lname2 in [(lname1,lname2),(lname2,lname1)]:
-        if lname1 in bin.tags:
-          func()
+      for lname1,lname2 in ((lname1,lname2),(lname2,lname1)):
+        if lname1 not in tags or (tagonly and lname2 in tags):
+          continue
+        if maximal:
+          w[lname1] = min(w.get(lname1,1),r2)
+        else:
+          w[lname1] = w.get(lname1,0) + r2
 
     if not w:
       return {}
@@ -1569,7 +1760,7 @@ class TagSelector(object):
 def read_design_score(filename):
   sf = autofile(filename)
   for line in sf:
-    fields = re_spaces.split(line.strip())
+    fields = line.replace(',',' ').split()
     lname = fields[0]
     try:
       score = float(fields[1])
@@ -1609,25 +1800,51 @@ def load_genotypes(filename, options):
 
 
 def filter_loci(loci, include, subset, options):
+  '''
+  Filter loci by minimum MAF, inclusion in subset, genomic range,
+  completion and deviation from Hardy-Weinberg proportions.  All but the
+  last are evaluated together as boolean masks over arrays of locus
+  attributes.  The HWP test is computed only for loci that pass them.
+
+  Loci come in two flavors, each with a distinct minimum MAF.  If the
+  locus.name is not in the provided include set, then the maf option is
+  used as a threshold.  Otherwise, the obmaf (minimum obligate MAF)
+  threshold is applied.
+  '''
   if getattr(options,'obmaf',None) is None:
     options.obmaf = options.maf
 
+  loci = list(loci)
+  mask = np.ones(len(loci), dtype=bool)
+
   if options.maf or options.obmaf:
-    loci = filter_loci_by_maf(loci, options.maf, options.obmaf, include)
+    mafs     = np.array([ locus.maf for locus in loci ], dtype=float)
+    included = np.array([ locus.name in include for locus in loci ], dtype=bool)
+    mask    &= mafs >= np.where(included, options.obmaf, options.maf)
 
   if subset is not None:
-    loci = filter_loci_by_inclusion(loci, subset)
+    mask &= np.array([ locus.name in subset for locus in loci ], dtype=bool)
 
   if options.range:
-    loci = filter_loci_by_range(loci, options.range)
+    ranges    = np.array(parse_ranges(options.range), dtype=np.int64)
+    locations = np.array([ locus.location for locus in loci ], dtype=np.int64)
+    starts    = ranges[:,0,np.newaxis]
+    stops     = ranges[:,1,np.newaxis]
+    mask     &= ((starts <= locations) & (locations < stops)).any(axis=0)
 
   if options.mincompletion or options.mincompletionrate:
-    loci = filter_loci_by_completion(loci, options.mincompletion, options.mincompletionrate)
+    n     = np.array([ len(locus.genos) for locus in loci ], dtype=np.int64)
+    m     = n - np.array([ locus.missing for locus in loci ], dtype=np.int64)
+    rate  = m / np.maximum(n,1).astype(float)
+    mask &= (m >= options.mincompletion) & (rate >= options.mincompletionrate)
 
   if options.hwp:
-    loci = filter_loci_by_hwp(loci, options.hwp)
+    for i in np.flatnonzero(mask):
+      locus = loci[i]
+      if locus.genos and hwp_biallelic(locus.genos[0].model,locus.genocounts) < options.hwp:
+        mask[i] = False
 
-  return loci
+  return [ locus for locus,keep in izip(loci,mask) if keep ]
 
 
 def order_loci(loci):
@@ -1640,53 +1857,82 @@ def order_loci(loci):
 
 def filter_loci_ldsubset(loci, ldsubset, maxd):
   '''
-  Yield only loci where there exists at least one monitored location within
-  maxd distance.
+  Return only loci where there exists at least one monitored location within
+  maxd distance.  Loci must be ordered by chromosome and location, as by
+  order_loci, and are returned in the same order.
 
-  This implementation performs two linear passes over the list of loci, one
-  forward and one in reverse.  As such, a locus may be yielded twice if it
-  is within maxd if a monitored location on both the left and the right.
+  Since loci are ordered, it suffices to check the nearest monitored locus
+  on either side of each locus, which are found for all loci at once by
+  binary search over the indices of the monitored loci.
   '''
   if ldsubset is None:
     return loci
 
-  monitor = [ (l.chromosome,l.location) for l in loci if l.name in ldsubset ]
+  monitor = np.array([ i for i,l in enumerate(loci) if l.name in ldsubset ], dtype=int)
+
+  if not len(monitor):
+    return []
 
-  n = len(loci)
-  keep = set()
+  chromosomes = {}
+  chroms      = np.array([ chromosomes.setdefault(l.chromosome,len(chromosomes)) for l in loci ])
+  locations   = np.array([ l.location for l in loci ], dtype=np.int64)
 
-  # Scan forward though loci, yielding all following loci within maxd of a
-  # monitored location
-  pos = 0
-  for chr,loc in monitor:
-    while pos < n and (loci[pos].chromosome,loci[pos].location) < (chr,loc):
-      pos += 1
-    while pos < n and loci[pos].chromosome==chr and loci[pos].location-loc <= maxd:
-      keep.add(loci[pos])
-      pos += 1
+  # Nearest monitored locus at or after, and at or before, each locus.  Where
+  # there is none, the nearest one on the other side is used instead.
+  index = np.arange(len(loci))
+  last  = len(monitor)-1
+  right = monitor[np.minimum(np.searchsorted(monitor,index),last)]
+  left  = monitor[np.maximum(np.searchsorted(monitor,index,side='right')-1,0)]
 
-  # Scan backward though loci, yielding all prior loci within maxd if a
-  # monitored location
-  pos = n-1
-  for chr,loc in reversed(monitor):
-    while pos >= 0 and (loci[pos].chromosome,loci[pos].location) > (chr,loc):
-      pos -= 1
-    while pos >= 0 and loci[pos].chromosome==chr and loc-loci[pos].location <= maxd:
-      keep.add(loci[pos])
-      pos -= 1
+  keep  = ( (chroms[right]==chroms) & (abs(locations[right]-locations) <= maxd) ) \
+        | ( (chroms[left] ==chroms) & (abs(locations[left] -locations) <= maxd) )
 
-  return order_loci(keep)
+  return [ loci[i] for i in np.flatnonzero(keep) ]
 
 
 def update_locus_map(locusmap, loci):
-  addloci = dict( (locus.name,locus) for locus in loci )
-  overlap = set(addloci).intersection(locusmap)
-  if overlap:
-    raise TagZillaError('ERROR: Genotype files may not contain overlapping loci')
-  locusmap.update(addloci)
+  for locus in loci:
+    name = locus.name
+    if name in locusmap:
+      raise TagZillaError('ERROR: Genotype files may not contain overlapping loci')
+    locusmap[name] = locus
+
+
+def ldpairs_from_file_packed(filename, include, subset, ldsubset, options):
+  '''
+  Load and scan a genotype file for LD pairs in a worker process, returning
+  the locus map and the materialized pairs of each region
+  '''
+  locusmap = {}
+  regions  = generate_ldpairs_from_file(filename, locusmap, include, subset, ldsubset, options)
+  regions  = [ list(pairs) for pairs in regions ]
+
+  # Genotypes are not needed once LD has been estimated and cannot be sent
+  # back to the parent process
+  for locus in locusmap.itervalues():
+    locus.genos = None
+
+  return locusmap,regions
 
 
 def generate_ldpairs(options, locusmap, include, subset, ldsubset):
+  # Modules that share this function may not offer parallel loading
+  processes = min(getattr(options, 'processes', 1), len(options.genotypes))
+
+  if processes > 1:
+    state = (include,subset,ldsubset,options)
+    files = pool_imap(ldpairs_from_file_packed, options.genotypes, processes, state)
+
+    for lmap,regions in files:
+      locusmap.update(lmap)
+
+      for ldpairs in regions:
+        yield ldpairs
+
+      locusmap.clear()
+
+    return
+
   for filename in options.genotypes:
     regions = generate_ldpairs_from_file(filename, locusmap, include, subset, ldsubset, options)
 
@@ -1701,11 +1947,15 @@ def generate_ldpairs(options, locusmap, include, subset, ldsubset):
 def generate_ldpairs_from_file(filename, locusmap, include, subset, ldsubset, options):
   sys.stderr.write('[%s] Processing input file %s\n' % (time.asctime(),filename))
 
+  # Pre-computed LD files are treated as a single region
   if options.informat == 'festa':
-    return load_festa_file(filename, locusmap, subset, options.r)
+    return [ load_festa_file(filename, locusmap, subset, options.r) ]
 
   elif options.informat == 'hapmapld':
-    return load_hapmapld_file(filename, locusmap, subset, options.maxdist*1000, options.r, options.d)
+    return [ load_hapmapld_file(filename, locusmap, subset, options.maxdist*1000, options.r, options.d) ]
+
+  elif options.informat == 'ldpairs':
+    return [ load_ldpairs_file(filename, locusmap, subset, options.r, options.d) ]
 
   else: # generate from genotype file
     loci = load_genotypes(filename,options)
@@ -1732,18 +1982,44 @@ def get_populations(option):
   return labels
 
 
+class _TagsRequiredCache(dict):
+  '''
+  Memoize the number of tags required by bin size, computing each size
+  only on first use
+
+  >>> required = _TagsRequiredCache(lambda n: n//2+1)
+  >>> required[5],required[5],required[2]
+  (3, 3, 2)
+  >>> sorted(required.items())
+  [(2, 2), (5, 3)]
+  '''
+  __slots__ = ('tags_required',)
+
+  def __init__(self, tags_required):
+    dict.__init__(self)
+    self.tags_required = tags_required
+
+  def __missing__(self, n):
+    required = self[n] = self.tags_required(n)
+    return required
+
+
 def get_tags_required_function(options):
   if options.locipertag:
-    return lambda n: min(int(n//options.locipertag)+1,n)
+    k = options.locipertag
+    tags_required = lambda n: min(int(n//k)+1,n)
   elif options.loglocipertag:
     l = log(options.loglocipertag)
-    return lambda n: int(ceil(log(n+1)/l))
+    tags_required = lambda n: int(ceil(log(n+1)/l))
   else:
     return None
 
+  # Bin sizes repeat constantly, so look them up in C via the cache
+  return _TagsRequiredCache(tags_required).__getitem__
+
 
 def option_parser():
-  from glu.lib.glu_argparse import GLUArgumentParser
+  from glu.lib.glu_argparse import GLUArgumentParser, process_count
 
   parser = GLUArgumentParser(description=__abstract__)
 
@@ -1790,7 +2066,8 @@ def option_parser():
   outputgroup.add_argument('-O', '--locusinfo', metavar='FILE',
                           help='Output locus information to FILE')
   outputgroup.add_argument('-u', '--saveldpairs', metavar='FILE',
-                          help='Output pairwise LD estimates to FILE')
+                          help='Output pairwise LD estimates to FILE.  They may be binned again by '
+                               'loading FILE with -f ldpairs')
   outputgroup.add_argument('-x', '--extra', action='count',
                           help='Output inter-bin LD statistics')
 
@@ -1809,6 +2086,8 @@ def option_parser():
   genoldgroup.add_argument('-P', '--hwp', metavar='p', default=None, type=float,
                           help='Filter out loci that fail to meet a minimum significance level (pvalue) for a '
                                'test Hardy-Weinberg proportion (no default)')
+  genoldgroup.add_argument('--processes', metavar='N', type=process_count, default=1,
+                          help='Number of worker processes used to load and scan input files in parallel (default=1)')
 
   bingroup = parser.add_argument_group('Binning options')
 
@@ -1836,12 +2115,14 @@ def option_parser():
 
 
 def do_tagging(ldpairs, locusmap, includes, exclude, designscores, options):
+  get_tags_required = get_tags_required_function(options)
+
   # If we require a total ordering, then build binsets from all ldpairs
   if options.targetbins or options.targetloci:
     sys.stderr.write('[%s] Building global binsets\n' % time.asctime())
     binsets,lddata = build_binsets(locusmap, ldpairs, includes, exclude, designscores)
     sys.stderr.write('[%s] Choosing global bins\n' % time.asctime())
-    bins = binner(locusmap, binsets, lddata, includes, get_tags_required_function(options))
+    bins = binner(locusmap, binsets, lddata, includes, get_tags_required)
     yield bins,lddata
   else:
     # Otherwise, process each sequence of ldpairs independently
@@ -1849,7 +2130,7 @@ def do_tagging(ldpairs, locusmap, includes, exclude, designscores, options):
       sys.stderr.write('[%s] Generating LD and binsets for region %d\n' % (time.asctime(),i+1))
       binsets,lddata = build_binsets(locusmap, [pairs], includes, exclude, designscores)
       sys.stderr.write('[%s] Choosing bins for region %d\n' % (time.asctime(),i+1))
-      bins = binner(locusmap, binsets, lddata, includes, get_tags_required_function(options))
+      bins = binner(locusmap, binsets, lddata, includes, get_tags_required)
       yield bins,lddata
 
 
@@ -1894,9 +2175,10 @@ class Includes(object):
 
     self.typed   = typed - untyped
     self.untyped = untyped
+    self.all     = self.typed | untyped
 
   def __contains__(self, other):
-    return other in self.typed or other in self.untyped
+    return other in self.all
 
   def __iter__(self):
     return chain(self.typed,self.untyped)
@@ -1941,9 +2223,9 @@ def tagzilla_single(options):
     ldpairs = save_ldpairs(options.saveldpairs, ldpairs)
 
   if options.skipbinning:
-    # Fast trick to save all ld results, but not store them
+    # Drain the pairs in C to save all ld results, but not store them
     for pairs in ldpairs:
-      list(dropwhile(lambda x: True, pairs))
+      deque(pairs, maxlen=0)
     return
 
   results = do_tagging(ldpairs, locusmap, includes, exclude, designscores, options)
@@ -1977,6 +2259,11 @@ def tagzilla_single(options):
       pairinfo.emit_bin(bin, qualifier, population, options)
       locusinfo.emit_bin(bin, locusmap, qualifier, population)
 
+      # Binned loci are never looked up again, so release them (and their
+      # genotypes) while the remaining bins are chosen
+      for lname in chain(bin.tags,bin.others):
+        locusmap.pop(lname,None)
+
     # Process remaining items in lddata and output residual ld information
     # (i.e. the inter-bin pairwise)
     if options.extra:
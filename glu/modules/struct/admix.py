@@ -15,6 +15,7 @@ import numpy as np
 
 from   itertools                 import izip
 
+from   glu.lib.utils             import chunk, pool_imap
 from   glu.lib.fileutils         import table_writer, table_reader
 from   glu.lib.progressbar       import progress_loop
 from   glu.lib.genolib           import load_genostream, geno_options
@@ -27,6 +28,9 @@ EPSILON=np.finfo(float).eps
 ABSTOL=1e-6
 RELTOL=1e-9
 
+# Number of samples sent to a worker process at a time
+SAMPLE_BATCH_SIZE=16
+
 
 def admixture_log_likelihood_python(f,x):
   '''
@@ -370,13 +374,66 @@ def classify_ancestry(labels,x,threshold):
   return ipop
 
 
-def compute_frequencies(freq_model,sample_count,models,geno_counts):
-  # Set missing genotypes to zero
-  geno_counts[:,0] = 0
+def estimate_sample_admixture(pops,inds):
+  '''
+  Estimate the admixture coefficients of a single individual from its
+  genotype indices
+  '''
+  # Compute genotype frequencies
+  f      = individual_frequencies(pops,inds)
+
+  # Find feasible starting values
+  x0     = estimate_admixture_em(f,iters=10)
+
+  # Estimate admixture
+  x,l,it = estimate_admixture_sqp(f, x0)
+
+  return x
+
+
+def estimate_batch_admixture(batch,pops):
+  '''
+  Estimate admixture coefficients for a batch of (sample,indices) pairs in a
+  worker process
+  '''
+  return [ (sample,estimate_sample_admixture(pops,inds)) for sample,inds in batch ]
+
+
+def estimate_admixture_parallel(test,pops,processes):
+  '''
+  Estimate admixture coefficients using a pool of worker processes
+
+  Population frequencies are shared with each worker once, when the pool
+  is created.  Results are generated in input order.
+  '''
+  samples = ( (sample,genotype_indices(genos)) for sample,genos in test )
+  batches = chunk(samples,SAMPLE_BATCH_SIZE)
 
+  for results in pool_imap(estimate_batch_admixture,batches,processes,(pops,)):
+    for result in results:
+      yield result
+
+
+def compute_frequencies(freq_model,sample_count,models,geno_counts):
+  '''
+  Compute the genotype frequencies of each locus from a matrix of genotype
+  counts, either directly (GENO) or assuming Hardy-Weinberg proportions
+  (HWP)
+
+  >>> m1 = build_model('AG',max_alleles=2)
+  >>> m2 = build_model('G',max_alleles=2)
+  >>> counts = np.array([[1,4,4,2],[2,5,0,0]])
+  >>> compute_frequencies('GENO',10,[m1,m2],counts.copy())
+  array([[ 0.        ,  0.4       ,  0.4       ,  0.2       ],
+         [ 0.        ,  0.71428571,  0.14285714,  0.14285714]])
+  >>> compute_frequencies('HWP',10,[m1,m2],counts.copy())
+  array([[ 0.  ,  0.36,  0.48,  0.16],
+         [ 0.  ,  1.  ,  0.  ,  0.  ]])
+  '''
   if freq_model.upper() == 'GENO':
-    # Set each genotype to be observed at least once
-    np.clip(geno_counts,1,1e300,out=geno_counts)
+    # Set each genotype to be observed at least once and missing genotypes
+    # to zero
+    np.maximum(geno_counts,1,out=geno_counts)
     geno_counts[:,0] = 0
 
     # Compute frequencies
@@ -384,29 +441,50 @@ def compute_frequencies(freq_model,sample_count,models,geno_counts):
     geno_freqs = geno_counts/n
 
   elif freq_model.upper() == 'HWP':
-    geno_freqs = np.zeros(geno_counts.shape, dtype=float)
-
-    for i,model in enumerate(models):
-      n = 2*geno_counts[i].sum()
-
-      if not n or len(model.alleles)!=3:
-        p = 1/sample_count
-      else:
-        a,b  =  model.alleles[1:3]
-        inds = (model[a,a].index,
-                model[a,b].index,
-                model[b,b].index)
-
-        hom1 = geno_counts[i,inds[0]]
-        hets = geno_counts[i,inds[1]]
+    # Set missing genotypes to zero
+    geno_counts[:,0] = 0
 
-        p    = (2*hom1+hets)/n
+    # Look up the indices of the (a,a), (a,b) and (b,b) genotypes once per
+    # distinct model.  Genotypes absent from a model with fewer than two
+    # alleles are mapped to the missing genotype, whose frequency is
+    # reset below.
+    model_inds = {}
+    inds       = np.empty( (len(models),3), dtype=int )
 
-      q = 1-p
+    for i,model in enumerate(models):
+      minds = model_inds.get(model)
+
+      if minds is None:
+        alleles = model.alleles[1:]
+        if len(alleles)==2:
+          a,b   = alleles
+          minds = (model[a,a].index,model[a,b].index,model[b,b].index)
+        elif len(alleles)==1:
+          a     = alleles[0]
+          minds = (model[a,a].index,0,0)
+        else:
+          minds = (0,0,0)
+        model_inds[model] = minds
+
+      inds[i] = minds
+
+    rows = np.arange(len(inds))
+    hom1 = geno_counts[rows,inds[:,0]]
+    hets = geno_counts[rows,inds[:,1]]
+    n    = 2*geno_counts.sum(axis=1)
+
+    # Loci with no observed genotypes are given a minimal allele frequency
+    p    = np.empty(len(n), dtype=float)
+    p.fill(1/sample_count)
+    obs  = n>0
+    p[obs] = (2*hom1[obs]+hets[obs])/n[obs]
+    q    = 1-p
 
-      geno_freqs[i,inds[0]] =   p*p
-      geno_freqs[i,inds[1]] = 2*p*q
-      geno_freqs[i,inds[2]] =   q*q
+    geno_freqs = np.zeros(geno_counts.shape, dtype=float)
+    geno_freqs[rows,inds[:,0]] =   p*p
+    geno_freqs[rows,inds[:,1]] = 2*p*q
+    geno_freqs[rows,inds[:,2]] =   q*q
+    geno_freqs[:,0] = 0
   else:
     raise ValueError('Invalid genotype likelihood model specified: %s' % model)
 
@@ -573,7 +651,7 @@ def build_labels(options):
 
 
 def option_parser():
-  from glu.lib.glu_argparse import GLUArgumentParser
+  from glu.lib.glu_argparse import GLUArgumentParser, process_count
 
   parser = GLUArgumentParser(description=__abstract__)
 
@@ -591,6 +669,8 @@ def option_parser():
                     help='Imputed ancestry threshold (default=0.80)')
   parser.add_argument('-o', '--output', metavar='FILE', default='-',
                     help='output table file name')
+  parser.add_argument('--processes', metavar='N', type=process_count, default=1,
+                    help='Number of worker processes used to estimate admixture in parallel (default=1)')
   parser.add_argument('-P', '--progress', action='store_true',
                     help='Show analysis progress bar, if possible')
 
@@ -614,16 +694,13 @@ def main():
   if options.progress and test.samples:
     test = progress_loop(test, length=len(test.samples), units='samples')
 
-  for sample,genos in test:
-    # Compute genotype frequencies
-    f      = individual_frequencies(pops,genotype_indices(genos))
-
-    # Find feasible starting values
-    x0     = estimate_admixture_em(f,iters=10)
-
-    # Estimate admixture
-    x,l,it = estimate_admixture_sqp(f, x0)
+  if options.processes > 1:
+    results = estimate_admixture_parallel(test,pops,options.processes)
+  else:
+    results = ( (sample,estimate_sample_admixture(pops,genotype_indices(genos)))
+                for sample,genos in test )
 
+  for sample,x in results:
     ipop   = classify_ancestry(labels, x, options.threshold)
 
     out.writerow([sample]+['%.4f' % a for a in x] + [ipop])
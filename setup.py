@@ -86,6 +86,8 @@ def cython_modules():
             Extension('glu.lib._illumina',              sources = ['glu/lib/_illumina.pyx']),
             Extension('glu.lib.genolib.helpers',        sources = ['glu/lib/genolib/helpers.pyx'],
                                                    include_dirs = [np.get_include()]),
+            Extension('glu.lib.genolib.formats._prettybase',
+                                                        sources = ['glu/lib/genolib/formats/_prettybase.pyx']),
             Extension('glu.lib.seqlib._cigar',          sources = ['glu/lib/seqlib/_cigar.pyx']),
             Extension('glu.lib.seqlib._edits',          sources = ['glu/lib/seqlib/_edits.pyx']),
             Extension('glu.lib.seqlib.gc',              sources = ['glu/lib/seqlib/gc.pyx']),
@@ -100,6 +102,8 @@ def cython_modules():
             Extension('glu.lib._illumina',              sources = ['glu/lib/_illumina.c']),
             Extension('glu.lib.genolib.helpers',        sources = ['glu/lib/genolib/helpers.c'],
                                                    include_dirs = [np.get_include()]),
+            Extension('glu.lib.genolib.formats._prettybase',
+                                                        sources = ['glu/lib/genolib/formats/_prettybase.c']),
             Extension('glu.lib.seqlib._cigar',          sources = ['glu/lib/seqlib/_cigar.c']),
             Extension('glu.lib.seqlib._edits',          sources = ['glu/lib/seqlib/_edits.c']),
             Extension('glu.lib.seqlib.gc',              sources = ['glu/lib/seqlib/gc.c']),